@@ -0,0 +1,166 @@
+"""
+Micro-benchmarks for the game engine and the search agents.
+
+USAGE:      python benchmark.py <options>
+EXAMPLES:   (1) python benchmark.py
+                - search throughput and state footprint on mediumClassic
+            (2) python benchmark.py -p MinimaxAgent -a depth=3 -m 5
+            (3) python benchmark.py --scaling 11,21,51,101,201 -p AlphaBetaAgent -a depth=2
+                - successor and search speed on generated square mazes of each size
+"""
+import gc, random, sys, time
+import layout, pacman, ghostAgents, layoutGenerator
+from pacman import GameState
+
+def sizeOf(obj):
+  "Shallow size of obj, including its instance __dict__ if it has one."
+  size = sys.getsizeof(obj)
+  if hasattr(obj, '__dict__'):
+    size += sys.getsizeof(obj.__dict__)
+  return size
+
+def successorFootprint(state, agentIndex=0):
+  """
+  Returns (bytes, objects) owned by one successor of state: everything the
+  successor allocates rather than shares with its parent.
+  """
+  action = state.getLegalActions(agentIndex)[0]
+  gc.collect()
+  before = len(gc.get_objects())
+  successors = [state.generateSuccessor(agentIndex, action) for i in range(1000)]
+  objects = (len(gc.get_objects()) - before - 1) / 1000.0
+
+  successor = successors[0]
+  data = successor.data
+  agentState = data.agentStates[agentIndex]
+  owned = [successor, data, data.agentStates, agentState, agentState.configuration]
+  return sum([sizeOf(obj) for obj in owned]), objects
+
+class _CountingGameState(GameState):
+  "A GameState that counts every successor generated from it or its descendants."
+  __slots__ = ()
+  generated = 0
+
+  def generateSuccessor(self, agentIndex, action):
+    _CountingGameState.generated += 1
+    state = GameState.generateSuccessor(self, agentIndex, action)
+    state.__class__ = _CountingGameState
+    return state
+
+def benchmarkSearch(lay, pacmanAgent, ghosts, numMoves, seed=0):
+  """
+  Plays numMoves Pacman moves with pacmanAgent and returns
+  (nodes generated, seconds spent searching).
+  """
+  random.seed(seed)
+  state = GameState()
+  state.initialize(lay, len(ghosts))
+  state.__class__ = _CountingGameState
+  nodes, elapsed = 0, 0.0
+  for move in range(numMoves):
+    for agentIndex in range(state.getNumAgents()):
+      if state.isWin() or state.isLose(): return nodes, elapsed
+      _CountingGameState.generated = 0
+      if agentIndex == 0:
+        start = time.time()
+        action = pacmanAgent.getAction(state)
+        elapsed += time.time() - start
+        nodes += _CountingGameState.generated
+      else:
+        action = ghosts[agentIndex - 1].getAction(state)
+      state = state.generateSuccessor(agentIndex, action)
+  return nodes, elapsed
+
+def timeSuccessors(lay, numGhosts, numSuccessors, seed=0):
+  """
+  Plays random moves for every agent, starting a new game whenever one
+  ends, and returns the mean seconds per generateSuccessor call.
+  """
+  random.seed(seed)
+  start = GameState()
+  start.initialize(lay, numGhosts)
+  state = start
+  agentIndex = 0
+  elapsed = 0.0
+  for i in range(numSuccessors):
+    if state.isWin() or state.isLose():
+      state, agentIndex = start, 0
+    action = random.choice(state.getLegalActions(agentIndex))
+    begin = time.time()
+    state = state.generateSuccessor(agentIndex, action)
+    elapsed += time.time() - begin
+    agentIndex = (agentIndex + 1) % state.getNumAgents()
+  return elapsed / numSuccessors
+
+def benchmarkScaling(sizes, agentFactory, ghostType, numGhosts, numMoves, seed=0):
+  """
+  Prints, for a generated square maze of each size, the cost of one
+  successor and the search speed of a fresh agent from agentFactory.
+  """
+  print '%5s %7s  %14s  %12s' % ('Size', 'Cells', 'Successor (us)', 'Nodes/s')
+  for size in sizes:
+    lay = layoutGenerator.generateLayout(size, size, numGhosts, seed=seed)
+    ghosts = [ghostType(i + 1) for i in range(numGhosts)]
+    successor = timeSuccessors(lay, numGhosts, 20000, seed)
+    nodes, elapsed = benchmarkSearch(lay, agentFactory(), ghosts, numMoves, seed)
+    print '%5d %7d  %14.1f  %12.0f' % (size, len(lay.static.cells), successor * 1e6, nodes / max(elapsed, 1e-9))
+
+def readCommand(argv):
+  from optparse import OptionParser
+  parser = OptionParser(__doc__)
+  parser.add_option('-l', '--layout', dest='layout', default='mediumClassic',
+                    help=pacman.default('the LAYOUT_FILE to benchmark on'))
+  parser.add_option('-p', '--pacman', dest='pacman', default='MinimaxAgent',
+                    help=pacman.default('the search agent TYPE to benchmark'))
+  parser.add_option('-a', '--agentArgs', dest='agentArgs', default='depth=3',
+                    help=pacman.default('Comma separated values sent to the agent'))
+  parser.add_option('-g', '--ghosts', dest='ghost', default='RandomGhost',
+                    help=pacman.default('the ghost agent TYPE in the ghostAgents module to use'))
+  parser.add_option('-k', '--numghosts', type='int', dest='numGhosts', default=2,
+                    help=pacman.default('The maximum number of ghosts to use'))
+  parser.add_option('-m', '--moves', type='int', dest='numMoves', default=20,
+                    help=pacman.default('Number of Pacman moves to search'))
+  parser.add_option('--scaling', dest='scaling', default=None,
+                    help='Comma separated SIZES of generated square mazes to benchmark on instead of the layout')
+  options, otherjunk = parser.parse_args(argv)
+  if len(otherjunk) != 0:
+    raise Exception('Command line input not understood: ' + str(otherjunk))
+  return options
+
+if __name__ == '__main__':
+  options = readCommand(sys.argv[1:])
+  if options.scaling != None:
+    agentType = pacman.loadAgent(options.pacman, True)
+    agentArgs = pacman.parseAgentArgs(options.agentArgs)
+    sizes = [int(size) for size in options.scaling.split(',')]
+    benchmarkScaling(sizes, lambda: agentType(**agentArgs), getattr(ghostAgents, options.ghost),
+                     options.numGhosts, options.numMoves)
+    sys.exit(0)
+  lay = layout.getLayout(options.layout)
+  if lay == None: raise Exception("The layout " + options.layout + " cannot be found")
+  numGhosts = min(options.numGhosts, lay.getNumGhosts())
+  ghostType = getattr(ghostAgents, options.ghost)
+  ghosts = [ghostType(i + 1) for i in range(numGhosts)]
+  agent = pacman.loadAgent(options.pacman, True)(**pacman.parseAgentArgs(options.agentArgs))
+
+  state = GameState()
+  state.initialize(lay, numGhosts)
+  size, objects = successorFootprint(state)
+  print 'Successor footprint:  %d bytes, %.1f objects' % (size, objects)
+
+  nodes, elapsed = benchmarkSearch(lay, agent, ghosts, options.numMoves)
+  print 'Search:               %d nodes in %.2fs (%.0f nodes/s)' % (nodes, elapsed, nodes / max(elapsed, 1e-9))
+  table = getattr(agent, 'transpositionTable', None)
+  if table != None:
+    print 'Transposition table:  %d entries, %d hits, %d misses (%.1f%% hit rate), %d evictions' % \
+          (len(table), table.hits, table.misses, 100 * table.hitRate(), table.evictions)
+  if getattr(agent, 'leafBatches', 0) > 0:
+    print 'Leaf batches:         %d batches, %.1f leaves per batch' % \
+          (agent.leafBatches, agent.leavesEvaluated / float(agent.leafBatches))
+  if hasattr(agent, 'cutoffs'):
+    print 'Alpha-beta:           %d nodes expanded, %d cutoffs' % (agent.nodesExpanded, agent.cutoffs)
+  if hasattr(agent, 'errorBound'):
+    print 'Expectimax:           %d branches pruned, last move error bound %.3f' % (agent.prunedBranches, agent.errorBound)
+  if hasattr(agent, 'iterationsPerSecond'):
+    print 'MCTS:                 %d iterations in %.2fs (%.0f iterations/s)' % \
+          (agent.totalIterations, agent.totalTime, agent.totalIterations / max(agent.totalTime, 1e-9))
@@ -1,5 +1,5 @@
 from util import *
-import time, os
+import time, os, random
 import traceback
 import sys
 
@@ -33,12 +33,20 @@ class Directions:
                WEST: EAST,
                STOP: STOP}
 
-class Configuration:
+class Configuration(object):
+    __slots__ = ('pos', 'direction')
 
     def __init__(self, pos, direction):
         self.pos = pos
         self.direction = direction
 
+    # Slotted classes need these to pickle with protocols 0 and 1.
+    def __getstate__(self):
+        return (self.pos, self.direction)
+
+    def __setstate__(self, state):
+        self.pos, self.direction = state
+
     def getPosition(self):
         return (self.pos)
 
@@ -70,8 +78,8 @@ class Configuration:
             direction = self.direction 
         return Configuration((x + dx, y+dy), direction)
 
-class AgentState:
-   
+class AgentState(object):
+    __slots__ = ('start', 'configuration', 'isPacman', 'scaredTimer', 'numCarrying', 'numReturned')
 
     def __init__( self, startConfiguration, isPacman ):
         self.start = startConfiguration
@@ -81,6 +89,13 @@ class AgentState:
         self.numCarrying = 0
         self.numReturned = 0
 
+    def __getstate__( self ):
+        return tuple([getattr(self, name) for name in AgentState.__slots__])
+
+    def __setstate__( self, state ):
+        for name, value in zip(AgentState.__slots__, state):
+            setattr(self, name, value)
+
     def __str__( self ):
         if self.isPacman:
             return "Pacman: " + str( self.configuration )
@@ -110,65 +125,106 @@ class AgentState:
     def getDirection(self):
         return self.configuration.getDirection()
 
+class _GridColumn(object):
+    __slots__ = ('grid', 'offset')
+
+    def __init__(self, grid, x):
+        self.grid = grid
+        self.offset = x * grid.height
+
+    def __getitem__(self, y):
+        if y < 0: y += self.grid.height
+        if y < 0 or y >= self.grid.height: raise IndexError('Grid column index out of range')
+        return (self.grid.bits >> (self.offset + y)) & 1 == 1
+
+    def __setitem__(self, y, item):
+        if y < 0: y += self.grid.height
+        if y < 0 or y >= self.grid.height: raise IndexError('Grid column index out of range')
+        if item:
+            self.grid.bits |= 1 << (self.offset + y)
+        else:
+            self.grid.bits &= ~(1 << (self.offset + y))
+
+    def __len__(self):
+        return self.grid.height
+
+    def __iter__(self):
+        bits = self.grid.bits >> self.offset
+        for y in range(self.grid.height):
+            yield (bits >> y) & 1 == 1
+
 class Grid:
-    
+    """
+    A width x height grid of booleans stored as a bitboard: cell (x, y) is
+    bit x * height + y of the integer self.bits.  grid[x][y] indexing still
+    works through a lightweight column view.
+    """
+
     def __init__(self, width, height, initialValue=False, bitRepresentation=None):
         if initialValue not in [False, True]: raise Exception('Grids can only contain booleans')
         self.CELLS_PER_INT = 30
 
         self.width = width
         self.height = height
-        self.data = [[initialValue for y in range(height)] for x in range(width)]
+        if initialValue:
+            self.bits = (1 << (width * height)) - 1
+        else:
+            self.bits = 0
         if bitRepresentation:
             self._unpackBits(bitRepresentation)
 
     def __getitem__(self, i):
-        return self.data[i]
+        if i < 0: i += self.width
+        if i < 0 or i >= self.width: raise IndexError('Grid index out of range')
+        return _GridColumn(self, i)
 
     def __setitem__(self, key, item):
-        self.data[key] = item
+        column = self[key]
+        for y, value in enumerate(item):
+            column[y] = value
 
     def __str__(self):
-        out = [[str(self.data[x][y])[0] for x in range(self.width)] for y in range(self.height)]
+        out = [[str(self[x][y])[0] for x in range(self.width)] for y in range(self.height)]
         out.reverse()
         return '\n'.join([''.join(x) for x in out])
 
     def __eq__(self, other):
         if other == None: return False
-        return self.data == other.data
+        return self.bits == other.bits and self.width == other.width and self.height == other.height
+
+    def __ne__(self, other):
+        return not self == other
 
     def __hash__(self):
-        
-        base = 1
-        h = 0
-        for l in self.data:
-            for i in l:
-                if i:
-                    h += base
-                base *= 2
-        return hash(h)
+        return hash(self.bits)
 
     def copy(self):
         g = Grid(self.width, self.height)
-        g.data = [x[:] for x in self.data]
+        g.bits = self.bits
         return g
 
     def deepCopy(self):
         return self.copy()
 
     def shallowCopy(self):
-        g = Grid(self.width, self.height)
-        g.data = self.data
-        return g
+        return self.copy()
 
     def count(self, item =True ):
-        return sum([x.count(item) for x in self.data])
+        n = bin(self.bits).count('1')
+        if item: return n
+        return self.width * self.height - n
 
     def asList(self, key = True):
+        bits = self.bits
+        if not key:
+            bits ^= (1 << (self.width * self.height)) - 1
+        height = self.height
         list = []
-        for x in range(self.width):
-            for y in range(self.height):
-                if self[x][y] == key: list.append( (x,y) )
+        while bits:
+            low = bits & -bits
+            i = low.bit_length() - 1
+            list.append( (i // height, i % height) )
+            bits ^= low
         return list
 
     def packBits(self):
@@ -177,8 +233,7 @@ class Grid:
         currentInt = 0
         for i in range(self.height * self.width):
             bit = self.CELLS_PER_INT - (i % self.CELLS_PER_INT) - 1
-            x, y = self._cellIndexToPosition(i)
-            if self[x][y]:
+            if (self.bits >> i) & 1:
                 currentInt += 2 ** bit
             if (i + 1) % self.CELLS_PER_INT == 0:
                 bits.append(currentInt)
@@ -197,8 +252,7 @@ class Grid:
         for packed in bits:
             for bit in self._unpackInt(packed, self.CELLS_PER_INT):
                 if cell == self.width * self.height: break
-                x, y = self._cellIndexToPosition(cell)
-                self[x][y] = bit
+                if bit: self.bits |= 1 << cell
                 cell += 1
 
     def _unpackInt(self, packed, size):
@@ -300,17 +354,43 @@ class Actions:
         return (x + dx, y + dy)
     getSuccessor = staticmethod(getSuccessor)
 
-class GameStateData:
-   
+_ZOBRIST_RANDOM = random.Random(188)
+_ZOBRIST_KEYS = {}
+
+def zobristKey(*feature):
+    "A fixed random 62-bit key for feature, drawn the first time it is seen."
+    key = _ZOBRIST_KEYS.get(feature)
+    if key == None:
+        key = _ZOBRIST_KEYS[feature] = _ZOBRIST_RANDOM.getrandbits(62)
+    return key
+
+def _agentKey(index, agentState):
+    conf = agentState.configuration
+    return zobristKey(index, conf.pos, conf.direction) ^ zobristKey(index, agentState.scaredTimer)
+
+class GameStateData(object):
+    """
+    _hash is the Zobrist hash of the agents, food and capsules.  It is built
+    once in initialize and then maintained by updateHash as successors are
+    generated, so code that edits a state by hand must call rehash().
+    """
+    __slots__ = ('food', 'capsules', 'agentStates', 'layout', 'score', 'scoreChange',
+                 '_eaten', '_agentsCopied', '_foodEaten', '_foodAdded', '_capsuleEaten',
+                 '_agentMoved', '_lose', '_win', '_hash')
+
     def __init__( self, prevState = None ):
         
         if prevState != None:
-            self.food = prevState.food.shallowCopy()
-            self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates( prevState.agentStates )
+            # Successors share food, capsules and agent states with their
+            # parent; the rules copy whatever they touch before mutating it.
+            self.food = prevState.food
+            self.capsules = prevState.capsules
+            self.agentStates = prevState.agentStates[:]
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
+            self._hash = prevState._hash
+        self._agentsCopied = 0
 
         self._foodEaten = None
         self._foodAdded = None
@@ -320,10 +400,23 @@ class GameStateData:
         self._win = False
         self.scoreChange = 0
 
+    def __getstate__( self ):
+        # A dict, as the board's fields are unset until initialize.
+        return dict([(name, getattr(self, name)) for name in GameStateData.__slots__ if hasattr(self, name)])
+
+    def __setstate__( self, state ):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def deepCopy( self ):
         state = GameStateData( self )
         state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
+        state.capsules = self.capsules[:]
+        state.agentStates = self.copyAgentStates( self.agentStates )
+        state._agentsCopied = -1
+        # Layouts are never modified once parsed, so copies share them and
+        # a copy costs O(agents) rather than a re-parse of the board.
+        state.layout = self.layout
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
@@ -336,9 +429,78 @@ class GameStateData:
             copiedStates.append( agentState.copy() )
         return copiedStates
 
+    def getMutableAgentState( self, index ):
+        if not (self._agentsCopied >> index) & 1:
+            self.agentStates[index] = self.agentStates[index].copy()
+            self._agentsCopied |= 1 << index
+        return self.agentStates[index]
+
+    def updateHash( self, prevState ):
+        """
+        Brings _hash up to date after the rules produced this state from
+        prevState: XORs out the old and in the new version of every agent
+        that changed, and XORs out any food or capsule that was eaten.
+        """
+        h = self._hash
+        if self._agentsCopied:
+            prevAgents = prevState.agentStates
+            for index, agentState in enumerate( self.agentStates ):
+                if agentState is not prevAgents[index]:
+                    h ^= _agentKey( index, prevAgents[index] ) ^ _agentKey( index, agentState )
+        if self._foodEaten != None:
+            h ^= zobristKey( 'food', self._foodEaten )
+        if self._capsuleEaten != None:
+            h ^= zobristKey( 'capsule', self._capsuleEaten )
+        self._hash = h
+
+    def rehash( self ):
+        h = 0
+        for index, agentState in enumerate( self.agentStates ):
+            h ^= _agentKey( index, agentState )
+        for position in self.food.asList():
+            h ^= zobristKey( 'food', position )
+        for position in self.capsules:
+            h ^= zobristKey( 'capsule', position )
+        self._hash = h
+
+    def pack( self ):
+        """
+        A compact tuple of plain values describing this state apart from its
+        layout, cheap to pickle and ship between processes.
+        """
+        agents = tuple([(a.configuration.pos, a.configuration.direction, a.start.pos, a.start.direction,
+                         a.isPacman, a.scaredTimer, a.numCarrying, a.numReturned) for a in self.agentStates])
+        return (agents, self.food.bits, tuple(self.capsules), self.score, self._eaten, self._lose, self._win)
+
+    def unpack( layout, packed ):
+        "Rebuilds the GameStateData that pack() described, on the given layout."
+        agents, foodBits, capsules, score, eaten, lose, win = packed
+        data = GameStateData()
+        data.layout = layout
+        data.food = Grid( layout.width, layout.height )
+        data.food.bits = foodBits
+        data.capsules = list( capsules )
+        data.score = score
+        data.agentStates = []
+        for pos, direction, startPos, startDirection, isPacman, scaredTimer, numCarrying, numReturned in agents:
+            agentState = AgentState( Configuration( startPos, startDirection ), isPacman )
+            agentState.configuration = Configuration( pos, direction )
+            agentState.scaredTimer = scaredTimer
+            agentState.numCarrying = numCarrying
+            agentState.numReturned = numReturned
+            data.agentStates.append( agentState )
+        data._agentsCopied = -1
+        data._eaten = eaten
+        data._lose = lose
+        data._win = win
+        data.rehash()
+        return data
+    unpack = staticmethod( unpack )
+
     def __eq__( self, other ):
         
         if other == None: return False
+        if self._hash != other._hash: return False
         if not self.agentStates == other.agentStates: return False
         if not self.food == other.food: return False
         if not self.capsules == other.capsules: return False
@@ -346,18 +508,11 @@ class GameStateData:
         return True
 
     def __hash__( self ):
-        
-        for i, state in enumerate( self.agentStates ):
-            try:
-                int(hash(state))
-            except TypeError, e:
-                print e
-                
-        return int((hash(tuple(self.agentStates)) + 13*hash(self.food) + 113* hash(tuple(self.capsules)) + 7 * hash(self.score)) % 1048575 )
+        return hash( (self._hash, self.score) )
 
     def __str__( self ):
         width, height = self.layout.width, self.layout.height
-        map = Grid(width, height)
+        map = [[' ' for y in range(height)] for x in range(width)]
         if type(self.food) == type((1,2)):
             self.food = reconstituteGrid(self.food)
         for x in range(width):
@@ -378,7 +533,9 @@ class GameStateData:
         for x, y in self.capsules:
             map[x][y] = 'o'
 
-        return str(map) + ("\nScore: %d\n" % self.score)
+        rows = [''.join([map[x][y] for x in range(width)]) for y in range(height)]
+        rows.reverse()
+        return '\n'.join(rows) + ("\nScore: %d\n" % self.score)
 
     def _foodWallStr( self, hasFood, hasWall ):
         if hasFood:
@@ -422,7 +579,9 @@ class GameStateData:
                 if numGhosts == numGhostAgents: continue
                 else: numGhosts += 1
             self.agentStates.append( AgentState( Configuration( pos, Directions.STOP), isPacman) )
-        self._eaten = [False for a in self.agentStates]
+        self._agentsCopied = -1
+        self._eaten = (False,) * len(self.agentStates)
+        self.rehash()
 
 try:
     import boinc
@@ -432,7 +591,8 @@ except:
 
 class Game:
 
-    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False ):
+    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False,
+                  copyObservations=True ):
         self.agentCrashed = False
         self.agents = agents
         self.display = display
@@ -441,8 +601,11 @@ class Game:
         self.gameOver = False
         self.muteAgents = muteAgents
         self.catchExceptions = catchExceptions
+        # Without copyObservations, agents that have no observationFunction
+        # are handed the game's own state instead of a deep copy of it.
+        self.copyObservations = copyObservations
         self.moveHistory = []
-        self.totalAgentTimes = [0 for agent in agents]
+        self.totalAgentTimes = [0.0 for agent in agents]
         self.totalAgentTimeWarnings = [0 for agent in agents]
         self.agentTimeout = False
         import cStringIO
@@ -480,6 +643,19 @@ class Game:
 
 
     def run( self ):
+        """
+        Plays the game.  However it ends, even by a crash or an exception,
+        agents with a cleanup method are then asked to release what they
+        hold for the game, such as worker processes.
+        """
+        try:
+            self._runGame()
+        finally:
+            for agent in self.agents:
+                if agent and "cleanup" in dir( agent ):
+                    agent.cleanup()
+
+    def _runGame( self ):
         self.display.initialize(self.state.data)
         self.numMoves = 0
         for i in range(len(self.agents)):
@@ -490,17 +666,18 @@ class Game:
                 self.unmute()
                 self._agentCrash(i, quiet=True)
                 return
+            if ("setMoveTimeout" in dir(agent)):
+                agent.setMoveTimeout(self.rules.getMoveTimeout(i))
             if ("registerInitialState" in dir(agent)):
                 self.mute(i)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.registerInitialState, int(self.rules.getMaxStartupTime(i)))
+                        start_time = time.time()
                         try:
-                            start_time = time.time()
-                            timed_func(self.state.deepCopy())
-                            time_taken = time.time() - start_time
-                            self.totalAgentTimes[i] += time_taken
+                            timedCall(self.rules.getMaxStartupTime(i), agent.registerInitialState, self.state.deepCopy())
+                            self.totalAgentTimes[i] += time.time() - start_time
                         except TimeoutFunctionException:
+                            self.totalAgentTimes[i] += time.time() - start_time
                             print >>sys.stderr, "Agent %d ran out of time on startup!" % i
                             self.unmute()
                             self.agentTimeout = True
@@ -511,7 +688,9 @@ class Game:
                         self.unmute()
                         return
                 else:
+                    start_time = time.time()
                     agent.registerInitialState(self.state.deepCopy())
+                    self.totalAgentTimes[i] += time.time() - start_time
                 self.unmute()
 
         agentIndex = self.startingIndex
@@ -525,10 +704,10 @@ class Game:
                 self.mute(agentIndex)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.observationFunction, int(self.rules.getMoveTimeout(agentIndex)))
+                        start_time = time.time()
                         try:
-                            start_time = time.time()
-                            observation = timed_func(self.state.deepCopy())
+                            observation = timedCall(self.rules.getMoveTimeout(agentIndex),
+                                                    agent.observationFunction, self.state.deepCopy())
                         except TimeoutFunctionException:
                             skip_action = True
                         move_time += time.time() - start_time
@@ -538,23 +717,27 @@ class Game:
                         self.unmute()
                         return
                 else:
+                    start_time = time.time()
                     observation = agent.observationFunction(self.state.deepCopy())
+                    move_time += time.time() - start_time
                 self.unmute()
-            else:
+            elif self.copyObservations:
                 observation = self.state.deepCopy()
+            else:
+                observation = self.state
 
             
             action = None
             self.mute(agentIndex)
             if self.catchExceptions:
                 try:
-                    timed_func = TimeoutFunction(agent.getAction, int(self.rules.getMoveTimeout(agentIndex)) - int(move_time))
+                    start_time = time.time()
                     try:
-                        start_time = time.time()
                         if skip_action:
                             raise TimeoutFunctionException()
-                        action = timed_func( observation )
+                        action = timedCall(self.rules.getMoveTimeout(agentIndex) - move_time, agent.getAction, observation)
                     except TimeoutFunctionException:
+                        self.totalAgentTimes[agentIndex] += move_time + time.time() - start_time
                         print >>sys.stderr, "Agent %d timed out on a single move!" % agentIndex
                         self.agentTimeout = True
                         self._agentCrash(agentIndex, quiet=True)
@@ -586,7 +769,9 @@ class Game:
                     self.unmute()
                     return
             else:
+                start_time = time.time()
                 action = agent.getAction(observation)
+                self.totalAgentTimes[agentIndex] += move_time + time.time() - start_time
             self.unmute()
             self.moveHistory.append( (agentIndex, action) )
             if self.catchExceptions:
@@ -1,13 +1,160 @@
-from util import manhattanDistance
-from game import Grid
+from util import manhattanDistance, nearestPoint
+from game import Grid, Actions, Directions, Configuration
+from array import array
 import os
 import random
+import hashlib
+import tempfile
+import cPickle
 
-VISIBILITY_MATRIX_CACHE = {}
+STATIC_LAYOUT_CACHE = {}
+DISTANCE_CACHE_DIR = None
+# Larger boards are not cached: their full table (2 n^2 bytes) costs more than the rows a game uses.
+MAX_CACHED_CELLS = 4096
+LAYOUT_CACHE_DIR = None
+# Bump whenever StaticLayout's attributes change, so older .layc files are reparsed.
+LAYOUT_CACHE_VERSION = 1
+LAYOUT_INDEXES = {}
+LAYOUT_TEXTS = {}
+UNREACHABLE = 65535
 
-class Layout:
- 
-  def __init__(self, layoutText):
+class MazeDistances:
+  """
+  Shortest-path distances between the open cells of a maze, numbered as
+  in its StaticLayout.  Row i of the table holds the BFS distances from
+  cell i as an array of unsigned shorts, so a lookup is two dict hits and
+  an index.  Rows are computed the first time they are used.
+  """
+
+  def __init__(self, static):
+    self.cellIds = static.cellIds
+    self.cells = static.cells
+    self.neighbors = static.neighbors
+    self.rows = [None] * len(self.cells)
+
+  def getDistance(self, pos1, pos2):
+    """
+    The maze distance between two positions, rounding positions halfway
+    between cells to a cell as nearestPoint does.  UNREACHABLE if there is
+    no path.  Raises an exception if either position is a wall or off the
+    board.
+    """
+    try:
+      i = self.cellIds[nearestPoint(pos1)]
+      row = self.rows[i]
+      if row == None: row = self._search(i)
+      return row[self.cellIds[nearestPoint(pos2)]]
+    except KeyError:
+      for pos in [pos1, pos2]:
+        if nearestPoint(pos) not in self.cellIds:
+          raise Exception('No maze distance from %s to %s: %s is not an open cell of the layout' % (pos1, pos2, pos))
+      raise
+
+  def _search(self, source):
+    row = array('H', [UNREACHABLE]) * len(self.cells)
+    row[source] = 0
+    frontier = [source]
+    neighbors = self.neighbors
+    distance = 0
+    while frontier:
+      distance += 1
+      nextFrontier = []
+      for cell in frontier:
+        for neighbor in neighbors[cell]:
+          if row[neighbor] == UNREACHABLE:
+            row[neighbor] = distance
+            nextFrontier.append(neighbor)
+      frontier = nextFrontier
+    self.rows[source] = row
+    return row
+
+  def computeAll(self):
+    for i in range(len(self.cells)):
+      if self.rows[i] == None: self._search(i)
+
+  def save(self, path):
+    self.computeAll()
+    def write(f):
+      for row in self.rows: row.tofile(f)
+    writeCacheFile(path, write)
+
+  def load(self, path):
+    """
+    Reads the table that save wrote to path.  Returns False, leaving the
+    table as it was, if the file is missing or too short.
+    """
+    n = len(self.cells)
+    try: f = open(path, 'rb')
+    except IOError: return False
+    try:
+      rows = []
+      for i in range(n):
+        row = array('H')
+        row.fromfile(f, n)
+        rows.append(row)
+    except EOFError:
+      return False
+    finally:
+      f.close()
+    self.rows = rows
+    return True
+
+def writeCacheFile(path, write):
+  """
+  Creates path by calling write on a temporary file in the same directory
+  and renaming it into place, so that other processes reading the cache
+  see either the whole file or none of it.
+  """
+  directory = os.path.dirname(path) or '.'
+  if not os.path.isdir(directory):
+    try: os.makedirs(directory)
+    except OSError:
+      if not os.path.isdir(directory): raise
+  fd, temporary = tempfile.mkstemp(suffix='.tmp', dir=directory)
+  try:
+    f = os.fdopen(fd, 'wb')
+    try: write(f)
+    finally: f.close()
+    os.rename(temporary, path)
+  except:
+    os.remove(temporary)
+    raise
+
+def getMazeDistances(layout):
+  """
+  The MazeDistances for layout, shared by every layout with the same text.
+  When DISTANCE_CACHE_DIR is set, complete tables of layouts with at most
+  MAX_CACHED_CELLS open cells are also kept there between runs, one file
+  per layout named by the hash of its text; a missing or incomplete file
+  is recomputed and rewritten.  Larger layouts compute rows as they are
+  used, as without a cache.
+  """
+  static = layout.static
+  if static.distances != None:
+    return static.distances
+  distances = MazeDistances(static)
+  if DISTANCE_CACHE_DIR != None and len(static.cells) <= MAX_CACHED_CELLS:
+    path = os.path.join(DISTANCE_CACHE_DIR, static.key + '.dist')
+    if not distances.load(path):
+      distances.save(path)
+  static.distances = distances
+  return distances
+
+class StaticLayout:
+  """
+  Everything about a board that no game changes: its text and walls, an
+  index of its open cells (numbered column by column) with each cell's
+  open neighbours, the legal moves from each cell, the food, capsules and
+  agent positions it starts with, and, once asked for, its maze distances
+  and visibility.  There is one
+  StaticLayout per distinct layout text in the process (see
+  getStaticLayout), shared by every Layout of that text, and the text is
+  parsed only when it is first created.
+  """
+
+  def __init__(self, layoutText, key):
+    self.key = key
+    self.layoutText = tuple(layoutText)
     self.width = len(layoutText[0])
     self.height= len(layoutText)
     self.walls = Grid(self.width, self.height, False)
@@ -16,31 +163,204 @@ class Layout:
     self.agentPositions = []
     self.numGhosts = 0
     self.processLayoutText(layoutText)
-    self.layoutText = layoutText
+    self.capsules = tuple(self.capsules)
+    self.agentPositions = tuple(self.agentPositions)
+
+    self.cellIds = {}
+    self.cells = []
+    for x in range(self.width):
+      for y in range(self.height):
+        if not self.walls[x][y]:
+          self.cellIds[(x, y)] = len(self.cells)
+          self.cells.append((x, y))
+    self.neighbors = []
+    for x, y in self.cells:
+      adjacent = [(x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y)]
+      self.neighbors.append(tuple([self.cellIds[cell] for cell in adjacent if cell in self.cellIds]))
+    self.buildActionTables()
+    self.distances = None
+    self.visibility = None
+
+  def buildActionTables(self):
+    """
+    The legal actions from every open cell, as PacmanRules and GhostRules
+    would compute them for an agent standing on it: pacmanActions[cell]
+    leaves out STOP, and ghostActions[cell][direction] also leaves out the
+    reverse of the ghost's direction unless it is the only way out.  The
+    tuples are shared by every state on the board.
+    """
+    self.pacmanActions = {}
+    self.ghostActions = {}
+    for cell in self.cells:
+      possible = Actions.getPossibleActions(Configuration(cell, Directions.STOP), self.walls)
+      moves = tuple([action for action in possible if action != Directions.STOP])
+      self.pacmanActions[cell] = moves
+      byDirection = {}
+      for direction in Actions._directions:
+        reverse = Actions.reverseDirection(direction)
+        if reverse in moves and len(moves) > 1:
+          byDirection[direction] = tuple([action for action in moves if action != reverse])
+        else:
+          byDirection[direction] = moves
+      self.ghostActions[cell] = byDirection
+
+  def getVisibility(self):
+    """
+    What Pacman sees from each open cell: getVisibility()[direction][cell]
+    is a bitset, numbered like the bits of a Grid, of the cells in a
+    straight line from cell in that direction up to the first wall.
+    Pacman sees nothing when stopped.  Each row and column is swept once,
+    on the first call, and the result is shared by every Layout of the
+    board.
+    """
+    if self.visibility == None:
+      height = self.height
+      visibility = {Directions.STOP: {}}
+      for direction in [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST]:
+        visibility[direction] = {}
+      for x in range(self.width):
+        self._sweep([(x, y) for y in range(height)], visibility[Directions.NORTH], visibility[Directions.SOUTH])
+      for y in range(height):
+        self._sweep([(x, y) for x in range(self.width)], visibility[Directions.EAST], visibility[Directions.WEST])
+      self.visibility = visibility
+    return self.visibility
+
+  def _sweep(self, line, forward, backward):
+    """
+    Fills in the sight lines along a row or column of cells, given in
+    increasing order: forward[cell] holds the open cells after cell up to
+    the next wall, backward[cell] those before it back to the last wall.
+    """
+    height = self.height
+    seen = 0
+    for x, y in line:
+      if self.walls[x][y]:
+        seen = 0
+      else:
+        backward[(x, y)] = seen
+        seen |= 1 << (x * height + y)
+    seen = 0
+    for x, y in reversed(line):
+      if self.walls[x][y]:
+        seen = 0
+      else:
+        forward[(x, y)] = seen
+        seen |= 1 << (x * height + y)
+
+  def processLayoutText(self, layoutText):
+    
+    maxY = self.height - 1
+    for y in range(self.height):       
+      for x in range(self.width):
+        layoutChar = layoutText[maxY - y][x]  
+        self.processLayoutChar(x, y, layoutChar)
+    self.agentPositions.sort()
+    self.agentPositions = [ ( i == 0, pos) for i, pos in self.agentPositions]
+  
+  def processLayoutChar(self, x, y, layoutChar):
+    if layoutChar == '%':      
+      self.walls[x][y] = True
+    elif layoutChar == '.':
+      self.food[x][y] = True 
+    elif layoutChar == 'o':    
+      self.capsules.append((x, y))   
+    elif layoutChar == 'P':    
+      self.agentPositions.append( (0, (x, y) ) )
+    elif layoutChar in ['G']:    
+      self.agentPositions.append( (1, (x, y) ) )
+      self.numGhosts += 1
+    elif layoutChar in  ['1', '2', '3', '4']:
+      self.agentPositions.append( (int(layoutChar), (x,y)))
+      self.numGhosts += 1 
+
+  def __getstate__(self):
+    # Distances and visibility are rebuilt on demand (distances have their own cache).
+    state = self.__dict__.copy()
+    state['distances'] = None
+    state['visibility'] = None
+    return state
+
+def getStaticLayout(layoutText):
+  """
+  The StaticLayout of layoutText, parsing the text only the first time it
+  is seen.  When LAYOUT_CACHE_DIR is set, parsed layouts are also kept
+  there between runs, one pickle per layout named by the hash of its text;
+  a missing or unreadable file, or one written for another
+  LAYOUT_CACHE_VERSION, is parsed again and rewritten.  The files are
+  unpickled, so the directory must be trusted.
+  """
+  key = hashlib.md5('\n'.join(layoutText)).hexdigest()
+  static = STATIC_LAYOUT_CACHE.get(key)
+  if static == None:
+    path = None
+    if LAYOUT_CACHE_DIR != None:
+      path = os.path.join(LAYOUT_CACHE_DIR, key + '.layc')
+      static = loadStaticLayout(path, layoutText)
+    if static == None:
+      static = StaticLayout(layoutText, key)
+      if path != None:
+        writeCacheFile(path, lambda f: cPickle.dump((LAYOUT_CACHE_VERSION, static), f, 2))
+    STATIC_LAYOUT_CACHE[key] = static
+  return static
+
+def loadStaticLayout(path, layoutText):
+  """
+  The StaticLayout of layoutText pickled at path, or None if the file is
+  missing or unreadable, or holds another text or cache version.
+  """
+  try: f = open(path, 'rb')
+  except IOError: return None
+  try:
+    try: cached = cPickle.load(f)
+    except Exception: return None
+  finally:
+    f.close()
+  if type(cached) != tuple or len(cached) != 2 or cached[0] != LAYOUT_CACHE_VERSION:
+    return None
+  static = cached[1]
+  if not isinstance(static, StaticLayout) or static.layoutText != tuple(layoutText):
+    return None
+  return static
+
+class Layout:
+  """
+  A board: its StaticLayout, which it shares with every other Layout of
+  the same text, plus its own copies of the starting food, capsules and
+  agent positions.  Game states and their copies share their Layout and
+  never modify it.
+  """
+ 
+  def __init__(self, layoutText):
+    static = getStaticLayout(layoutText)
+    self.static = static
+    self.layoutText = static.layoutText
+    self.width = static.width
+    self.height = static.height
+    self.walls = static.walls
+    self.pacmanActions = static.pacmanActions
+    self.ghostActions = static.ghostActions
+    self.food = static.food.copy()
+    self.capsules = list(static.capsules)
+    self.agentPositions = list(static.agentPositions)
+    self.numGhosts = static.numGhosts
+
+  def __getstate__(self):
+    return self.layoutText
+
+  def __setstate__(self, state):
+    if type(state) == dict:
+      # Pickled before layouts shared their static part.
+      state = state['layoutText']
+    self.__init__(state)
     
   def getNumGhosts(self):
     return self.numGhosts
+
+  def getMazeDistance(self, pos1, pos2):
+    return getMazeDistances(self).getDistance(pos1, pos2)
     
   def initializeVisibilityMatrix(self):
-    global VISIBILITY_MATRIX_CACHE
-    if reduce(str.__add__, self.layoutText) not in VISIBILITY_MATRIX_CACHE:
-      from game import Directions
-      vecs = [(-0.5,0), (0.5,0),(0,-0.5),(0,0.5)]
-      dirs = [Directions.NORTH, Directions.SOUTH, Directions.WEST, Directions.EAST]
-      vis = Grid(self.width, self.height, {Directions.NORTH:set(), Directions.SOUTH:set(), Directions.EAST:set(), Directions.WEST:set(), Directions.STOP:set()})
-      for x in range(self.width):
-        for y in range(self.height):
-          if self.walls[x][y] == False:
-            for vec, direction in zip(vecs, dirs):
-              dx, dy = vec
-              nextx, nexty = x + dx, y + dy
-              while (nextx + nexty) != int(nextx) + int(nexty) or not self.walls[int(nextx)][int(nexty)] :
-                vis[x][y][direction].add((nextx, nexty))
-                nextx, nexty = x + dx, y + dy
-      self.visibility = vis      
-      VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)] = vis
-    else:
-      self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
+    self.visibility = self.static.getVisibility()
       
   def isWall(self, pos):
     x, col = pos
@@ -64,56 +384,88 @@ class Layout:
     return pos
   
   def isVisibleFrom(self, ghostPos, pacPos, pacDirection):
+    """
+    Whether a ghost at ghostPos is in sight of Pacman at pacPos, facing
+    pacDirection.  A ghost between two cells is seen if both are on
+    Pacman's line of sight or on Pacman's cell, and at least one is in sight.
+    """
     row, col = [int(x) for x in pacPos]
-    return ghostPos in self.visibility[row][col][pacDirection]
+    seen = self.static.getVisibility()[pacDirection].get((row, col), 0)
+    x, y = ghostPos
+    height = self.height
+    near = 1 << (int(x) * height + int(y))
+    far = 1 << (int(x + 0.5) * height + int(y + 0.5))
+    line = seen | (1 << (row * height + col))
+    return (seen & (near | far)) != 0 and (line & near) != 0 and (line & far) != 0
   
   def __str__(self):
     return "\n".join(self.layoutText)
     
   def deepCopy(self):
-    return Layout(self.layoutText[:])
-    
-  def processLayoutText(self, layoutText):
-    
-    maxY = self.height - 1
-    for y in range(self.height):       
-      for x in range(self.width):
-        layoutChar = layoutText[maxY - y][x]  
-        self.processLayoutChar(x, y, layoutChar)
-    self.agentPositions.sort()
-    self.agentPositions = [ ( i == 0, pos) for i, pos in self.agentPositions]
-  
-  def processLayoutChar(self, x, y, layoutChar):
-    if layoutChar == '%':      
-      self.walls[x][y] = True
-    elif layoutChar == '.':
-      self.food[x][y] = True 
-    elif layoutChar == 'o':    
-      self.capsules.append((x, y))   
-    elif layoutChar == 'P':    
-      self.agentPositions.append( (0, (x, y) ) )
-    elif layoutChar in ['G']:    
-      self.agentPositions.append( (1, (x, y) ) )
-      self.numGhosts += 1
-    elif layoutChar in  ['1', '2', '3', '4']:
-      self.agentPositions.append( (int(layoutChar), (x,y)))
-      self.numGhosts += 1 
+    return Layout(self.layoutText)
+
 def getLayout(name, back = 2):
-  if name.endswith('.lay'):
-    layout = tryToLoad('layouts/' + name)
-    if layout == None: layout = tryToLoad(name)
-  else:
-    layout = tryToLoad('layouts/' + name + '.lay')
-    if layout == None: layout = tryToLoad(name + '.lay')
-  if layout == None and back >= 0:
-    curdir = os.path.abspath('.')
-    os.chdir('..')
-    layout = getLayout(name, back -1)
-    os.chdir(curdir)
-  return layout
+  """
+  Loads the layout called name (with or without .lay), looking in layouts/
+  and then in the directory itself, first in the working directory, then
+  in up to back + 1 directories above it, and last next to this module.
+  Returns None if there is no such layout.
+  """
+  filename = name
+  if not name.endswith('.lay'): filename = name + '.lay'
+  directories = getLayoutDirectories(back)
+  path = getLayoutIndex(directories).get(filename)
+  if path == None:
+    for directory in directories:
+      candidate = os.path.join(directory, filename)
+      if os.path.isfile(candidate):
+        path = candidate
+        break
+  if path == None: return None
+  return tryToLoad(path)
+
+def getLayoutDirectories(back = 2):
+  "The directories getLayout searches, in order, as absolute paths."
+  directories = []
+  parent = os.path.abspath('.')
+  for level in range(back + 2):
+    directories.append(os.path.join(parent, 'layouts'))
+    directories.append(parent)
+    parent = os.path.dirname(parent)
+  here = os.path.dirname(os.path.abspath(__file__))
+  directories.append(os.path.join(here, 'layouts'))
+  directories.append(here)
+  return directories
+
+def getLayoutIndex(directories):
+  """
+  A dict from .lay file name to the path of the first file of that name in
+  directories, listing each set of directories only once.
+  """
+  key = tuple(directories)
+  index = LAYOUT_INDEXES.get(key)
+  if index == None:
+    index = {}
+    for directory in directories:
+      if not os.path.isdir(directory): continue
+      for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.lay') and filename not in index:
+          path = os.path.join(directory, filename)
+          if os.path.isfile(path): index[filename] = path
+    LAYOUT_INDEXES[key] = index
+  return index
 
 def tryToLoad(fullname):
-  if(not os.path.exists(fullname)): return None
-  f = open(fullname)
-  try: return Layout([line.strip() for line in f])
-  finally: f.close()
+  """
+  The Layout in the file fullname, or None if there is no such file.  The
+  text of each file is read once and kept until the file changes.
+  """
+  try: modified = os.stat(fullname).st_mtime
+  except OSError: return None
+  cached = LAYOUT_TEXTS.get(fullname)
+  if cached == None or cached[0] != modified:
+    f = open(fullname)
+    try: cached = (modified, [line.strip() for line in f])
+    finally: f.close()
+    LAYOUT_TEXTS[fullname] = cached
+  return Layout(cached[1])
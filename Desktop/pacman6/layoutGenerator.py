@@ -0,0 +1,152 @@
+"""
+Procedural layouts: random mazes from a seed, from 5 x 5 (more with many
+ghosts and capsules; see getMinimumSize) up to any size, with a given
+number of ghosts and capsules and density of food, for measuring how the
+engine and the agents scale with the board.
+
+USAGE:      python layoutGenerator.py <options>
+EXAMPLES:   (1) python layoutGenerator.py -W 41 -H 21 -s 7 -o layouts/maze41x21.lay
+                - writes a 41 x 21 maze that seed 7 always reproduces
+            (2) python layoutGenerator.py -W 201 -H 201 -k 8 -c 20 -d 0.2
+                - prints a large maze with 8 ghosts, 20 capsules and sparse food
+"""
+import sys, random
+import layout
+from util import manhattanDistance
+
+def carveMaze(width, height, loopiness, rng):
+  """
+  A width x height maze as rows of characters, '%' for walls and ' ' for
+  open cells.  Open cells lie on odd coordinates, joined by a random
+  depth-first spanning tree; then each remaining wall between two open
+  cells is knocked down with probability loopiness, so the maze has loops
+  like the classic boards.  With an even width or height the last column
+  or row of open cells is left out, so that border is two walls thick.
+  """
+  rows = [['%'] * width for y in range(height)]
+  start = (1 + 2 * rng.randrange((width - 1) / 2), 1 + 2 * rng.randrange((height - 1) / 2))
+  rows[start[1]][start[0]] = ' '
+  stack = [start]
+  while stack:
+    x, y = stack[-1]
+    unvisited = [(dx, dy) for dx, dy in [(0, 2), (0, -2), (2, 0), (-2, 0)]
+                 if 0 < x + dx < width - 1 and 0 < y + dy < height - 1 and rows[y + dy][x + dx] == '%']
+    if not unvisited:
+      stack.pop()
+      continue
+    dx, dy = rng.choice(unvisited)
+    rows[y + dy / 2][x + dx / 2] = ' '
+    rows[y + dy][x + dx] = ' '
+    stack.append((x + dx, y + dy))
+
+  for y in range(1, height - 1):
+    for x in range(1, width - 1):
+      if rows[y][x] != '%' or x % 2 == y % 2: continue
+      horizontal = rows[y][x - 1] == ' ' and rows[y][x + 1] == ' '
+      vertical = rows[y - 1][x] == ' ' and rows[y + 1][x] == ' '
+      if (horizontal or vertical) and rng.random() < loopiness:
+        rows[y][x] = ' '
+  return rows
+
+def countOpenCells(width, height):
+  """
+  The number of open cells carveMaze always makes on a width x height
+  board: the cells on odd coordinates and the corridors of the tree
+  joining them.  Loops only add to it.
+  """
+  rooms = ((width - 1) / 2) * ((height - 1) / 2)
+  return max(0, 2 * rooms - 1)
+
+def getMinimumSize(numGhosts, numCapsules):
+  """
+  The smallest n for which an n x n maze has room for Pacman, numGhosts
+  ghosts, numCapsules capsules and one food: 5 for up to 5 ghosts and
+  capsules between them, 7 for up to 15.
+  """
+  size = 5
+  while countOpenCells(size, size) < numGhosts + numCapsules + 2:
+    size += 2
+  return size
+
+def generateLayoutText(width, height, numGhosts=2, numCapsules=2, foodDensity=0.5, loopiness=0.2, seed=None):
+  """
+  The text of a random width x height layout, in the form of a .lay file,
+  with Pacman, numGhosts ghosts and numCapsules capsules on open cells and
+  food on a foodDensity fraction of the rest (at least one).  Ghosts start
+  more than two steps from Pacman where the board allows it.  The same
+  arguments and seed always give the same layout.  The board needs
+  countOpenCells(width, height) >= numGhosts + numCapsules + 2; see
+  getMinimumSize for the smallest square board that has room.
+  """
+  needed = numGhosts + numCapsules + 2
+  if countOpenCells(width, height) < needed:
+    minimum = getMinimumSize(numGhosts, numCapsules)
+    raise Exception('A %d x %d maze has %d open cells, but Pacman, %d ghosts, %d capsules and one food need %d; '
+                    'the smallest square board with room is %d x %d' %
+                    (width, height, countOpenCells(width, height), numGhosts, numCapsules, needed, minimum, minimum))
+  rng = random.Random(seed)
+  rows = carveMaze(width, height, loopiness, rng)
+  cells = [(x, y) for y in range(height) for x in range(width) if rows[y][x] == ' ']
+  rng.shuffle(cells)
+
+  pacman = cells[0]
+  rest = cells[1:]
+  far = [cell for cell in rest if manhattanDistance(cell, pacman) > 2]
+  near = [cell for cell in rest if manhattanDistance(cell, pacman) <= 2]
+  rest = far + near
+  ghosts = rest[:numGhosts]
+  capsules = rest[numGhosts:numGhosts + numCapsules]
+  rest = rest[numGhosts + numCapsules:]
+  rng.shuffle(rest)
+  food = rest[:max(1, int(round(foodDensity * len(rest))))]
+
+  x, y = pacman
+  rows[y][x] = 'P'
+  for x, y in ghosts: rows[y][x] = 'G'
+  for x, y in capsules: rows[y][x] = 'o'
+  for x, y in food: rows[y][x] = '.'
+  return [''.join(row) for row in rows]
+
+def generateLayout(width, height, numGhosts=2, numCapsules=2, foodDensity=0.5, loopiness=0.2, seed=None):
+  "A Layout of generateLayoutText's random board."
+  return layout.Layout(generateLayoutText(width, height, numGhosts, numCapsules, foodDensity, loopiness, seed))
+
+def writeLayout(layoutText, filename):
+  "Saves layout text as a .lay file that getLayout can load."
+  f = open(filename, 'w')
+  try: f.write('\n'.join(layoutText) + '\n')
+  finally: f.close()
+
+def readCommand(argv):
+  from optparse import OptionParser
+  import pacman
+  parser = OptionParser(__doc__)
+  parser.add_option('-W', '--width', dest='width', type='int', default=21,
+                    help=pacman.default('the width of the layout'))
+  parser.add_option('-H', '--height', dest='height', type='int', default=11,
+                    help=pacman.default('the height of the layout'))
+  parser.add_option('-k', '--numghosts', dest='numGhosts', type='int', default=2,
+                    help=pacman.default('the number of ghosts'))
+  parser.add_option('-c', '--capsules', dest='numCapsules', type='int', default=2,
+                    help=pacman.default('the number of capsules'))
+  parser.add_option('-d', '--foodDensity', dest='foodDensity', type='float', default=0.5,
+                    help=pacman.default('the fraction of the remaining open cells with food'))
+  parser.add_option('--loopiness', dest='loopiness', type='float', default=0.2,
+                    help=pacman.default('the chance of opening each wall between two corridors'))
+  parser.add_option('-s', '--seed', dest='seed', type='int', default=None,
+                    help='the random seed; the same seed always gives the same layout')
+  parser.add_option('-o', '--output', dest='output', default=None,
+                    help='a .lay file to write the layout to, instead of printing it')
+  options, otherjunk = parser.parse_args(argv)
+  if len(otherjunk) != 0:
+    raise Exception('Command line input not understood: ' + str(otherjunk))
+  return options
+
+if __name__ == '__main__':
+  options = readCommand(sys.argv[1:])
+  layoutText = generateLayoutText(options.width, options.height, options.numGhosts, options.numCapsules,
+                                  options.foodDensity, options.loopiness, options.seed)
+  if options.output == None:
+    print '\n'.join(layoutText)
+  else:
+    writeLayout(layoutText, options.output)
@@ -3,14 +3,23 @@ from game import GameStateData
 from game import Game
 from game import Directions
 from game import Actions
+from game import Configuration
 from util import nearestPoint
 from util import manhattanDistance
 import util, layout
 import sys, types, time, random, os
 
+try:
+  import numpy
+  NUMPY_ENABLED = True
+except ImportError:
+  NUMPY_ENABLED = False
+
+_FOOD_ARRAY_CACHE = {}
 
-class GameState:
- 
+
+class GameState(object):
+  __slots__ = ('data',)
 
   def getLegalActions( self, agentIndex=0 ):
     """
@@ -29,7 +38,8 @@ class GameState:
 
     state = GameState(self)
     if agentIndex == 0:  
-      state.data._eaten = [False for i in range(state.getNumAgents())]
+      if True in state.data._eaten:
+        state.data._eaten = (False,) * state.getNumAgents()
       PacmanRules.applyAction( state, action )
     else:                
       GhostRules.applyAction( state, action, agentIndex )
@@ -37,12 +47,13 @@ class GameState:
     if agentIndex == 0:
       state.data.scoreChange += -TIME_PENALTY 
     else:
-      GhostRules.decrementTimer( state.data.agentStates[agentIndex] )
+      GhostRules.decrementTimer( state.data.getMutableAgentState( agentIndex ) )
 
     GhostRules.checkDeath( state, agentIndex )
 
     state.data._agentMoved = agentIndex
     state.data.score += state.data.scoreChange
+    state.data.updateHash( self.data )
     return state
 
   def getLegalPacmanActions( self ):
@@ -75,6 +86,15 @@ class GameState:
   def getGhostPositions(self):
     return [s.getPosition() for s in self.getGhostStates()]
 
+  def getVisibleGhosts( self ):
+    """
+    The states of the ghosts Pacman can see along the way it is facing.
+    """
+    pacman = self.data.agentStates[0].configuration
+    layout = self.data.layout
+    return [ghost for ghost in self.getGhostStates()
+            if layout.isVisibleFrom( ghost.getPosition(), pacman.getPosition(), pacman.getDirection() )]
+
   def getNumAgents( self ):
     return len( self.data.agentStates )
 
@@ -102,6 +122,35 @@ class GameState:
   def hasWall(self, x, y):
     return self.data.layout.walls[x][y]
 
+  def getFoodArray(self):
+    """
+    Food positions as an (n, 2) numpy array.  Arrays are cached by food
+    bitboard, so states that share a food grid share the array, which is
+    therefore read-only; copy it to change it.
+    """
+    food = self.data.food
+    key = (food.height, food.bits)
+    array = _FOOD_ARRAY_CACHE.get(key)
+    if array is None:
+      if len(_FOOD_ARRAY_CACHE) > 10000: _FOOD_ARRAY_CACHE.clear()
+      array = numpy.array(food.asList(), dtype=float).reshape(-1, 2)
+      array.setflags(write=False)
+      _FOOD_ARRAY_CACHE[key] = array
+    return array
+
+  def getGhostPositionArray(self):
+    "Ghost positions as a (numGhosts, 2) numpy array."
+    return numpy.array([s.configuration.pos for s in self.data.agentStates[1:]], dtype=float).reshape(-1, 2)
+
+  def getScaredTimerArray(self):
+    return numpy.array([s.scaredTimer for s in self.data.agentStates[1:]], dtype=int)
+
+  def getMazeDistance(self, pos1, pos2):
+    """
+    The length of the shortest path between two positions through the maze.
+    """
+    return self.data.layout.getMazeDistance(pos1, pos2)
+
   def isLose( self ):
     return self.data._lose
 
@@ -121,6 +170,12 @@ class GameState:
     state.data = self.data.deepCopy()
     return state
 
+  def __getstate__( self ):
+    return self.data
+
+  def __setstate__( self, data ):
+    self.data = data
+
   def __eq__( self, other ):
    
     return self.data == other.data
@@ -199,11 +254,18 @@ class PacmanRules:
   PACMAN_SPEED=1
 
   def getLegalActions( state ):
-   
-    possibleActions = Actions.getPossibleActions( state.getPacmanState().configuration, state.data.layout.walls )
+    """
+    The moves Pacman can make, as a tuple shared by every state with Pacman
+    on the same cell of the board.
+    """
+    conf = state.data.agentStates[0].configuration
+    legal = state.data.layout.pacmanActions.get( conf.pos )
+    if legal != None:
+      return legal
+    possibleActions = Actions.getPossibleActions( conf, state.data.layout.walls )
     if Directions.STOP in possibleActions:
       possibleActions.remove( Directions.STOP )
-    return possibleActions
+    return tuple( possibleActions )
   getLegalActions = staticmethod( getLegalActions )
 
   def applyAction( state, action ):
@@ -212,7 +274,7 @@ class PacmanRules:
     if action not in legal:
       raise Exception("Illegal action " + str(action))
 
-    pacmanState = state.data.agentStates[0]
+    pacmanState = state.data.getMutableAgentState( 0 )
 
     vector = Actions.directionToVector( action, PacmanRules.PACMAN_SPEED )
     pacmanState.configuration = pacmanState.configuration.generateSuccessor( vector )
@@ -239,26 +301,34 @@ class PacmanRules:
         state.data._win = True
     
     if( position in state.getCapsules() ):
-      state.data.capsules.remove( position )
+      capsules = state.data.capsules[:]
+      capsules.remove( position )
+      state.data.capsules = capsules
       state.data._capsuleEaten = position
       
       for index in range( 1, len( state.data.agentStates ) ):
-        state.data.agentStates[index].scaredTimer = SCARED_TIME
+        state.data.getMutableAgentState( index ).scaredTimer = SCARED_TIME
   consume = staticmethod( consume )
 
 class GhostRules:
   
   GHOST_SPEED=1.0
   def getLegalActions( state, ghostIndex ):
-    
+    """
+    The moves a ghost can make, from the board's table when it is on a
+    cell; a scared ghost between two cells takes the slow path.
+    """
     conf = state.getGhostState( ghostIndex ).configuration
+    byDirection = state.data.layout.ghostActions.get( conf.pos )
+    if byDirection != None:
+      return byDirection[conf.direction]
     possibleActions = Actions.getPossibleActions( conf, state.data.layout.walls )
     reverse = Actions.reverseDirection( conf.direction )
     if Directions.STOP in possibleActions:
       possibleActions.remove( Directions.STOP )
     if reverse in possibleActions and len( possibleActions ) > 1:
       possibleActions.remove( reverse )
-    return possibleActions
+    return tuple( possibleActions )
   getLegalActions = staticmethod( getLegalActions )
 
   def applyAction( state, action, ghostIndex):
@@ -267,7 +337,7 @@ class GhostRules:
     if action not in legal:
       raise Exception("Illegal ghost action " + str(action))
 
-    ghostState = state.data.agentStates[ghostIndex]
+    ghostState = state.data.getMutableAgentState( ghostIndex )
     speed = GhostRules.GHOST_SPEED
     if ghostState.scaredTimer > 0: speed /= 2.0
     vector = Actions.directionToVector( action, speed )
@@ -277,7 +347,8 @@ class GhostRules:
   def decrementTimer( ghostState):
     timer = ghostState.scaredTimer
     if timer == 1:
-      ghostState.configuration.pos = nearestPoint( ghostState.configuration.pos )
+      conf = ghostState.configuration
+      ghostState.configuration = Configuration( nearestPoint( conf.pos ), conf.direction )
     ghostState.scaredTimer = max( 0, timer - 1 )
   decrementTimer = staticmethod( decrementTimer )
 
@@ -299,10 +370,13 @@ class GhostRules:
   def collide( state, ghostState, agentIndex):
     if ghostState.scaredTimer > 0:
       state.data.scoreChange += 200
+      ghostState = state.data.getMutableAgentState( agentIndex )
       GhostRules.placeGhost(state, ghostState)
       ghostState.scaredTimer = 0
       
-      state.data._eaten[agentIndex] = True
+      eaten = list( state.data._eaten )
+      eaten[agentIndex] = True
+      state.data._eaten = tuple( eaten )
     else:
       if not state.data._win:
         state.data.scoreChange -= 500
@@ -368,9 +442,17 @@ def readCommand( argv ):
   parser.add_option('-f', '--fixRandomSeed', action='store_true', dest='fixRandomSeed',
                     help='Fixes the random seed to always play the same game', default=False)
   parser.add_option('-r', '--recordActions', action='store_true', dest='record',
-                    help='Writes game histories to a file (named by the time they were played)', default=False)
+                    help='Writes game histories to a recording file (named by the time they were played)', default=False)
   parser.add_option('--replay', dest='gameToReplay',
-                    help='A recorded game file (pickle) to replay', default=None)
+                    help='A recording file, or an older pickled game file, to replay', default=None)
+  parser.add_option('--replayGame', dest='replayGameIndex', type='int',
+                    help=default('Which game of the recording file to replay'), default=0)
+  parser.add_option('--replayFrom', dest='replayFrom', type='int',
+                    help=default('The move of the recorded game to start the replay from'), default=0)
+  parser.add_option('--replayTo', dest='replayTo', type='int',
+                    help='The move of the recorded game to stop the replay at [Default: the end]', default=None)
+  parser.add_option('--frameEvery', dest='frameEvery', type='int',
+                    help=default('Draw only every N-th move of a replay (text graphics only)'), default=1)
   parser.add_option('-a','--agentArgs',dest='agentArgs',
                     help='Comma separated values sent to agent. e.g. "opt1=val1,opt2,opt3=val3"')
   parser.add_option('-x', '--numTraining', dest='numTraining', type='int',
@@ -379,8 +461,14 @@ def readCommand( argv ):
                     help=default('Time to delay between frames; <0 means keyboard'), default=0.1)
   parser.add_option('-c', '--catchExceptions', action='store_true', dest='catchExceptions', 
                     help='Turns on exception handling and timeouts during games', default=False)
+  parser.add_option('--distanceCache', dest='distanceCache',
+                    help='A directory in which to keep precomputed maze distance tables (for layouts of up to %d open cells)' % layout.MAX_CACHED_CELLS, default=None)
+  parser.add_option('--layoutCache', dest='layoutCache',
+                    help='A directory in which to keep parsed layouts; it must be trusted, as its files are unpickled', default=None)
   parser.add_option('--timeout', dest='timeout', type='int',
                     help=default('Maximum length of time an agent can spend computing in a single game'), default=30)
+  parser.add_option('-o', '--results', dest='resultsFile',
+                    help='A file to stream one record per game to, as CSV if it ends in .csv, else JSON lines', default=None)
 
   options, otherjunk = parser.parse_args(argv)
   if len(otherjunk) != 0:
@@ -388,6 +476,8 @@ def readCommand( argv ):
   args = dict()
 
   if options.fixRandomSeed: random.seed('cs188')
+  layout.DISTANCE_CACHE_DIR = options.distanceCache
+  layout.LAYOUT_CACHE_DIR = options.layoutCache
 
   args['layout'] = layout.getLayout( options.layout )
   if args['layout'] == None: raise Exception("The layout " + options.layout + " cannot be found")
@@ -422,15 +512,33 @@ def readCommand( argv ):
   args['record'] = options.record
   args['catchExceptions'] = options.catchExceptions
   args['timeout'] = options.timeout
+  args['resultsFile'] = options.resultsFile
 
   if options.gameToReplay != None:
     print 'Replaying recorded game %s.' % options.gameToReplay
-    import cPickle
-    f = open(options.gameToReplay)
-    try: recorded = cPickle.load(f)
-    finally: f.close()
-    recorded['display'] = args['display']
-    replayGame(**recorded)
+    import recording
+    if recording.isRecording(options.gameToReplay):
+      # Quiet replays skip the display altogether.
+      display = args['display']
+      if options.quietGraphics: display = None
+      reader = recording.RecordingReader(options.gameToReplay)
+      try:
+        if options.replayGameIndex < 0 or options.replayGameIndex >= reader.getNumGames():
+          raise Exception('There is no game %d; the recording has %d games' % (options.replayGameIndex, reader.getNumGames()))
+        recordedGame = reader.getGame(options.replayGameIndex)
+        if options.replayFrom > recordedGame.numMoves:
+          raise Exception('Game %d has only %d moves to replay from' % (options.replayGameIndex, recordedGame.numMoves))
+        state = recording.replay(recordedGame, display, options.replayFrom, options.replayTo, options.frameEvery)
+      finally:
+        reader.close()
+      print 'Score after the replay: %d' % state.getScore()
+    else:
+      import cPickle
+      f = open(options.gameToReplay)
+      try: recorded = cPickle.load(f)
+      finally: f.close()
+      recorded['display'] = args['display']
+      replayGame(**recorded)
     sys.exit(0)
 
   return args
@@ -459,11 +567,14 @@ def loadAgent(pacman, nographics):
   raise Exception('The agent ' + pacman + ' is not specified in any *Agents.py.')
 
 def replayGame( layout, actions, display ):
-    import submission, ghostAgents
+    """
+    Shows a game from its list of (agentIndex, action) moves.  No agents
+    are needed; recording.replay does the same for recording files,
+    without a display or from any move.
+    """
     rules = ClassicGameRules()
-   
-    agents = [submission.ExpectimaxAgent()] + [ghostAgents.RandomGhost(i+1) for i in range(layout.getNumGhosts())]
-    game = rules.newGame( layout, agents[0], agents[1:], display )
+    numAgents = max([agentIndex for agentIndex, action in actions] + [0]) + 1
+    game = rules.newGame( layout, None, [None] * (numAgents - 1), display )
     state = game.state
     display.initialize(state.data)
 
@@ -477,48 +588,57 @@ def replayGame( layout, actions, display ):
 
     display.finish()
 
-def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30 ):
-  import __main__
+def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30,
+              resultsFile=None ):
+  """
+  Plays numGames games and returns a simulation.ResultsSummary of the
+  non-training ones.  Games are not kept: each one's result is added to
+  the summary, and streamed to resultsFile if given, as soon as it ends.
+  """
+  import __main__, simulation, recording
   __main__.__dict__['_display'] = display
 
   rules = ClassicGameRules(timeout)
-  games = []
-
-  for i in range( numGames ):
-    beQuiet = i < numTraining
-    if beQuiet:
+  summary = simulation.ResultsSummary()
+  writer = None
+  if resultsFile != None: writer = simulation.openResultsWriter(resultsFile)
+  recorder = None
+  if record:
+    fname = 'recorded-games-' + '-'.join([str(t) for t in time.localtime()[1:6]]) + '.pmr'
+    recorder = recording.RecordingWriter(fname)
+
+  try:
+    for i in range( numGames ):
+      beQuiet = i < numTraining
+      if beQuiet:
        
-        import textDisplay
-        gameDisplay = textDisplay.NullGraphics()
-        rules.quiet = True
-    else:
-        gameDisplay = display
-        rules.quiet = False
-    game = rules.newGame(layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions)
-    game.run()
-    if not beQuiet: games.append(game)
-
-    if record:
-      import time, cPickle
-      fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
-      f = file(fname, 'w')
-      components = {'layout': layout, 'actions': game.moveHistory}
-      cPickle.dump(components, f)
-      f.close()
-
+          import textDisplay
+          gameDisplay = textDisplay.NullGraphics()
+          rules.quiet = True
+      else:
+          gameDisplay = display
+          rules.quiet = False
+      game = rules.newGame(layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions)
+      start = time.time()
+      game.run()
+      if not beQuiet:
+        result = simulation.GameResult(i - numTraining, game, time.time() - start)
+        summary.add(result)
+        if writer != None: writer.write(result.record())
+
+      if recorder != None: recorder.addGame(game)
+  finally:
+    if writer != None: writer.close()
+    if recorder != None: recorder.close()
   if (numGames-numTraining) > 0:
-    scores = [game.state.getScore() for game in games]
-    wins = [game.state.isWin() for game in games]
-    winRate = wins.count(True)/ float(len(wins))
-    print 'Average Score:', sum(scores) / float(len(scores))
-    print 'Scores:       ', ', '.join([str(score) for score in scores])
-    print 'Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate)
-    print 'Record:       ', ', '.join([ ['Loss', 'Win'][int(w)] for w in wins])
+    summary.printSummary()
 
-  return games
+  return summary
 
 if __name__ == '__main__':
- 
+  # Modules that import pacman (agents, simulation, recording) get this
+  # running module rather than a second copy with its own classes and caches.
+  sys.modules['pacman'] = sys.modules['__main__']
   args = readCommand( sys.argv[1:] ) 
   runGames( **args )
 
@@ -0,0 +1,372 @@
+"""
+A compact binary format for recorded games, with many games per file.
+
+Layouts are stored once per file, keyed by the md5 of their text, and
+games refer to them by key.  A game's moves are 3-bit action codes; the
+agent making each move follows from the turn order.  Every
+checkpointInterval moves the game state is stored too (as a marshalled
+GameStateData.pack() tuple), so that any move of any game can be reached
+by unpacking the checkpoint before it and replaying at most
+checkpointInterval moves.
+
+File layout, all integers little-endian:
+
+  'PMRC' version:B
+  blocks, each a layout or a game:
+    'L' key:16s length:I text
+    'G' key:16s numAgents:B startingIndex:B numMoves:I score:i flags:B
+        (1 won, 2 lost, 4 an agent crashed)
+        checkpointInterval:I numCheckpoints:I
+        (offset:Q length:I) * numCheckpoints
+        actions: ceil(3 * numMoves / 8) bytes
+        checkpoints
+  index: numLayouts:I (key:16s offset:Q) * numLayouts
+         numGames:I offset:Q * numGames
+  indexOffset:Q 'PMRX'
+
+Files are read through mmap, so opening one reads only its index.
+
+USAGE:      python recording.py <options> FILE...
+EXAMPLES:   (1) python recording.py recorded-games-*.pmr
+                - lists the games in the recordings, with a summary
+            (2) python recording.py --replay recorded-games-*.pmr
+                - replays every game headless, checking its recorded result
+"""
+import os, struct, marshal, mmap, hashlib
+from game import Directions, GameStateData
+import layout, pacman
+
+MAGIC = 'PMRC'
+INDEX_MAGIC = 'PMRX'
+VERSION = 1
+DEFAULT_CHECKPOINT_INTERVAL = 100
+
+ACTIONS = (Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST, Directions.STOP)
+ACTION_CODES = dict([(action, code) for code, action in enumerate(ACTIONS)])
+
+_HEADER = struct.Struct('<4sB')
+_LAYOUT = struct.Struct('<c16sI')
+_GAME = struct.Struct('<c16sBBIiBII')
+_CHECKPOINT = struct.Struct('<QI')
+_COUNT = struct.Struct('<I')
+_LAYOUT_ENTRY = struct.Struct('<16sQ')
+_OFFSET = struct.Struct('<Q')
+_TRAILER = struct.Struct('<Q4s')
+
+WIN_FLAG = 1
+LOSE_FLAG = 2
+CRASH_FLAG = 4
+
+def layoutKey(lay):
+  "The 16-byte md5 digest of a layout's text, which identifies it within a file."
+  return hashlib.md5('\n'.join(lay.layoutText)).digest()
+
+def packActions(actions):
+  "Packs a sequence of actions into 3 bits each."
+  packed = bytearray((3 * len(actions) + 7) // 8)
+  bit = 0
+  for action in actions:
+    code = ACTION_CODES[action]
+    byte, shift = divmod(bit, 8)
+    packed[byte] |= (code << shift) & 0xff
+    if shift > 5:
+      packed[byte + 1] |= code >> (8 - shift)
+    bit += 3
+  return str(packed)
+
+def unpackAction(packed, move, start=0):
+  "The action of move number move in actions packed from offset start of packed."
+  byte, shift = divmod(3 * move, 8)
+  code = ord(packed[start + byte]) >> shift
+  if shift > 5:
+    code |= ord(packed[start + byte + 1]) << (8 - shift)
+  return ACTIONS[code & 7]
+
+def isRecording(filename):
+  "Whether filename holds games in this format (rather than, say, a pickled recording)."
+  f = open(filename, 'rb')
+  try: return f.read(len(MAGIC)) == MAGIC
+  finally: f.close()
+
+class RecordingWriter:
+  """
+  Writes games to a recording file.  Opening an existing recording
+  appends to it.  close() writes the index, which the file needs to be
+  readable.
+  """
+
+  def __init__(self, filename, checkpointInterval = DEFAULT_CHECKPOINT_INTERVAL):
+    self.checkpointInterval = checkpointInterval
+    self.layoutOffsets = {}
+    self.gameOffsets = []
+    if os.path.exists(filename) and os.path.getsize(filename) > 0:
+      reader = RecordingReader(filename)
+      try:
+        self.layoutOffsets = dict(reader.layoutOffsets)
+        self.gameOffsets = list(reader.gameOffsets)
+        indexOffset = reader.indexOffset
+      finally:
+        reader.close()
+      self.file = open(filename, 'r+b')
+      self.file.seek(indexOffset)
+      self.file.truncate()
+    else:
+      self.file = open(filename, 'wb')
+      self.file.write(_HEADER.pack(MAGIC, VERSION))
+
+  def addLayout(self, lay):
+    "Writes lay to the file unless it is already there; returns its key."
+    key = layoutKey(lay)
+    if key not in self.layoutOffsets:
+      text = '\n'.join(lay.layoutText)
+      self.layoutOffsets[key] = self.file.tell()
+      self.file.write(_LAYOUT.pack('L', key, len(text)))
+      self.file.write(text)
+    return key
+
+  def addGame(self, game):
+    "Records a finished Game."
+    self.addMoves(game.state.data.layout, len(game.agents), game.moveHistory, game.startingIndex,
+                  game.agentCrashed)
+
+  def addMoves(self, lay, numAgents, moveHistory, startingIndex = 0, crashed = False):
+    """
+    Records the game played on lay by numAgents agents, given its
+    (agentIndex, action) move history.  The moves are replayed to take
+    the checkpoints.  A game that ended on an illegal move, which a crashed
+    game's history can hold, is recorded up to that move and marked as
+    crashed.
+    """
+    key = self.addLayout(lay)
+    state = pacman.GameState()
+    state.initialize(lay, numAgents - 1)
+    checkpoints = []
+    for move in range(len(moveHistory)):
+      if move % self.checkpointInterval == 0 and move > 0:
+        checkpoints.append(marshal.dumps(state.data.pack()))
+      agentIndex, action = moveHistory[move]
+      if agentIndex != (startingIndex + move) % numAgents:
+        raise Exception('Move %d was made out of turn by agent %d' % (move, agentIndex))
+      if action not in state.getLegalActions(agentIndex):
+        moveHistory = moveHistory[:move]
+        crashed = True
+        break
+      state = state.generateSuccessor(agentIndex, action)
+    flags = 0
+    if state.isWin(): flags |= WIN_FLAG
+    if state.isLose(): flags |= LOSE_FLAG
+    if crashed: flags |= CRASH_FLAG
+
+    actions = packActions([action for agentIndex, action in moveHistory])
+    offset = self.file.tell()
+    self.gameOffsets.append(offset)
+    checkpointOffset = offset + _GAME.size + _CHECKPOINT.size * len(checkpoints) + len(actions)
+    self.file.write(_GAME.pack('G', key, numAgents, startingIndex, len(moveHistory), state.getScore(), flags,
+                               self.checkpointInterval, len(checkpoints)))
+    for checkpoint in checkpoints:
+      self.file.write(_CHECKPOINT.pack(checkpointOffset, len(checkpoint)))
+      checkpointOffset += len(checkpoint)
+    self.file.write(actions)
+    for checkpoint in checkpoints:
+      self.file.write(checkpoint)
+
+  def close(self):
+    indexOffset = self.file.tell()
+    self.file.write(_COUNT.pack(len(self.layoutOffsets)))
+    for key, offset in self.layoutOffsets.items():
+      self.file.write(_LAYOUT_ENTRY.pack(key, offset))
+    self.file.write(_COUNT.pack(len(self.gameOffsets)))
+    for offset in self.gameOffsets:
+      self.file.write(_OFFSET.pack(offset))
+    self.file.write(_TRAILER.pack(indexOffset, INDEX_MAGIC))
+    self.file.close()
+
+class RecordedGame:
+  "One game of a RecordingReader, read lazily from the mapped file."
+
+  def __init__(self, reader, offset):
+    self.reader = reader
+    (tag, self.layoutKey, self.numAgents, self.startingIndex, self.numMoves, self.score, flags,
+     self.checkpointInterval, numCheckpoints) = _GAME.unpack_from(reader.data, offset)
+    self.win = bool(flags & WIN_FLAG)
+    self.lose = bool(flags & LOSE_FLAG)
+    self.crashed = bool(flags & CRASH_FLAG)
+    self.checkpoints = [_CHECKPOINT.unpack_from(reader.data, offset + _GAME.size + _CHECKPOINT.size * i)
+                        for i in range(numCheckpoints)]
+    self.actionsOffset = offset + _GAME.size + _CHECKPOINT.size * numCheckpoints
+
+  def getLayout(self):
+    return self.reader.getLayout(self.layoutKey)
+
+  def getMove(self, move):
+    "The (agentIndex, action) of move number move."
+    if move < 0 or move >= self.numMoves:
+      raise IndexError('Move %d is out of range for a game of %d moves' % (move, self.numMoves))
+    return (self.startingIndex + move) % self.numAgents, unpackAction(self.reader.data, move, self.actionsOffset)
+
+  def getMoves(self, start = 0, stop = None):
+    "The (agentIndex, action) moves from start up to, not including, stop."
+    if stop == None: stop = self.numMoves
+    if start < 0 or stop > self.numMoves:
+      raise IndexError('Moves %d to %d are out of range for a game of %d moves' % (start, stop, self.numMoves))
+    data, offset, numAgents, first = self.reader.data, self.actionsOffset, self.numAgents, self.startingIndex
+    return [((first + move) % numAgents, unpackAction(data, move, offset)) for move in range(start, stop)]
+
+  def getState(self, move):
+    """
+    The GameState after the first move moves: the nearest checkpoint at
+    or before it, with the moves since replayed.
+    """
+    if move < 0 or move > self.numMoves:
+      raise IndexError('Move %d is out of range for a game of %d moves' % (move, self.numMoves))
+    lay = self.getLayout()
+    state = pacman.GameState()
+    checkpoint = min(move // self.checkpointInterval, len(self.checkpoints))
+    if checkpoint == 0:
+      state.initialize(lay, self.numAgents - 1)
+    else:
+      offset, length = self.checkpoints[checkpoint - 1]
+      state.data = GameStateData.unpack(lay, marshal.loads(self.reader.data[offset:offset + length]))
+    for agentIndex, action in self.getMoves(checkpoint * self.checkpointInterval, move):
+      state = state.generateSuccessor(agentIndex, action)
+    return state
+
+  def iterateStates(self, start = 0, stop = None):
+    """
+    Yields the GameStates after start, start + 1, ..., stop moves (stop
+    defaults to the end of the game), reaching the first through
+    getState.
+    """
+    if stop == None: stop = self.numMoves
+    state = self.getState(start)
+    yield state
+    for agentIndex, action in self.getMoves(start, stop):
+      state = state.generateSuccessor(agentIndex, action)
+      yield state
+
+def replay(recordedGame, display = None, start = 0, stop = None, frameEvery = 1):
+  """
+  Replays recordedGame from move start to move stop (by default, and at
+  most, the end) and returns the final GameState.  Without a display nothing is drawn.
+  Otherwise the display starts at move start and is updated every move
+  or, with frameEvery > 1, draws every frameEvery-th position and the
+  last one; that needs a display that can draw whole frames, such as
+  textDisplay's.
+  """
+  if stop == None or stop > recordedGame.numMoves: stop = recordedGame.numMoves
+  if start < 0 or start > stop:
+    raise Exception('Cannot replay from move %d to move %d of a game of %d moves' % (start, stop, recordedGame.numMoves))
+  if display == None:
+    for state in recordedGame.iterateStates(start, stop): pass
+    return state
+  if frameEvery > 1 and 'draw' not in dir(display):
+    raise Exception('This display can only show every move; use frameEvery = 1')
+
+  move = start
+  for state in recordedGame.iterateStates(start, stop):
+    if move == start:
+      display.initialize(state.data)
+    elif frameEvery == 1:
+      display.update(state.data)
+    elif (move - start) % frameEvery == 0 or move == stop:
+      display.draw(state.data)
+    move += 1
+  display.finish()
+  return state
+
+def iterateRecordings(filenames):
+  "Yields (filename, game index, RecordedGame) for every game in the given recording files."
+  for filename in filenames:
+    reader = RecordingReader(filename)
+    try:
+      for index in range(reader.getNumGames()):
+        yield filename, index, reader.getGame(index)
+    finally:
+      reader.close()
+
+class RecordingReader:
+  "Random access to the games of a recording file, which is memory-mapped."
+
+  def __init__(self, filename):
+    self.file = open(filename, 'rb')
+    self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version = _HEADER.unpack_from(self.data, 0)
+    if magic != MAGIC:
+      raise Exception('%s is not a game recording' % filename)
+    if version != VERSION:
+      raise Exception('%s is a version %d recording; this reader understands version %d' % (filename, version, VERSION))
+    self.indexOffset, indexMagic = _TRAILER.unpack_from(self.data, len(self.data) - _TRAILER.size)
+    if indexMagic != INDEX_MAGIC:
+      raise Exception('%s has no index; it was not closed after writing' % filename)
+
+    offset = self.indexOffset
+    numLayouts, = _COUNT.unpack_from(self.data, offset)
+    offset += _COUNT.size
+    self.layoutOffsets = {}
+    for i in range(numLayouts):
+      key, layoutOffset = _LAYOUT_ENTRY.unpack_from(self.data, offset)
+      self.layoutOffsets[key] = layoutOffset
+      offset += _LAYOUT_ENTRY.size
+    numGames, = _COUNT.unpack_from(self.data, offset)
+    offset += _COUNT.size
+    self.gameOffsets = [_OFFSET.unpack_from(self.data, offset + _OFFSET.size * i)[0] for i in range(numGames)]
+    self.layouts = {}
+
+  def getNumGames(self):
+    return len(self.gameOffsets)
+
+  def getGame(self, index):
+    return RecordedGame(self, self.gameOffsets[index])
+
+  def getLayout(self, key):
+    "The Layout stored under key, parsed once per reader."
+    if key not in self.layouts:
+      tag, storedKey, length = _LAYOUT.unpack_from(self.data, self.layoutOffsets[key])
+      start = self.layoutOffsets[key] + _LAYOUT.size
+      self.layouts[key] = layout.Layout(self.data[start:start + length].split('\n'))
+    return self.layouts[key]
+
+  def close(self):
+    self.data.close()
+    self.file.close()
+
+def readCommand(argv):
+  from optparse import OptionParser
+  parser = OptionParser(__doc__)
+  parser.add_option('--replay', action='store_true', dest='replay', default=False,
+                    help='Replays every game headless and checks it reaches its recorded result')
+  parser.add_option('-q', '--quiet', action='store_true', dest='quiet', default=False,
+                    help='Prints only the summary, not a line per game')
+  options, filenames = parser.parse_args(argv)
+  if len(filenames) == 0:
+    raise Exception('No recording files given')
+  return options, filenames
+
+if __name__ == '__main__':
+  import sys, time
+  import util
+  options, filenames = readCommand(sys.argv[1:])
+  scores = util.RunningStats()
+  wins, moves, mismatches = 0, 0, 0
+  start = time.time()
+  for filename, index, game in iterateRecordings(filenames):
+    scores.add(game.score)
+    moves += game.numMoves
+    if game.win: wins += 1
+    status = ''
+    if game.crashed: status = '  (crashed)'
+    if options.replay:
+      state = replay(game)
+      if state.getScore() != game.score or state.isWin() != game.win or state.isLose() != game.lose:
+        mismatches += 1
+        status += '  MISMATCH: replayed to score %d' % state.getScore()
+    if not options.quiet:
+      print '%s game %d: %s, score %d in %d moves%s' % (filename, index, ['Loss', 'Win'][game.win],
+                                                      game.score, game.numMoves, status)
+  elapsed = time.time() - start
+  print 'Games:         %d' % scores.count
+  print 'Average Score: %.2f' % scores.mean
+  print 'Win Rate:      %d/%d (%.2f)' % (wins, scores.count, wins / float(max(scores.count, 1)))
+  if options.replay:
+    print 'Replayed:      %d moves in %.2fs (%.0f moves/s), %d mismatches' % \
+          (moves, elapsed, moves / max(elapsed, 1e-9), mismatches)
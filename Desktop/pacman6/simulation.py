@@ -0,0 +1,210 @@
+"""
+Headless batch simulation: plays many games without a display or any
+per-game output and returns one GameResult per game.
+
+USAGE:      python simulation.py <options>
+EXAMPLES:   (1) python simulation.py -p ReflexAgent -n 1000
+                - plays 1000 games of ReflexAgent on mediumClassic
+            (2) python simulation.py -p MinimaxAgent -a depth=2 -n 100 -g DirectionalGhost
+"""
+import sys, time, random, csv, json
+from collections import OrderedDict
+import layout, pacman, textDisplay, util
+
+MAX_LISTED_GAMES = 100
+
+class GameResult(object):
+  "The outcome of one simulated game."
+  __slots__ = ('index', 'score', 'win', 'moves', 'agentTimes', 'crashed', 'timedOut', 'seconds')
+
+  def __init__(self, index, game, seconds):
+    self.index = index
+    self.score = game.state.getScore()
+    self.win = game.state.isWin()
+    self.moves = len(game.moveHistory)
+    self.agentTimes = tuple(game.totalAgentTimes)
+    self.crashed = game.agentCrashed
+    self.timedOut = game.agentTimeout
+    self.seconds = seconds
+
+  def __getstate__(self):
+    return tuple([getattr(self, name) for name in GameResult.__slots__])
+
+  def __setstate__(self, state):
+    for name, value in zip(GameResult.__slots__, state):
+      setattr(self, name, value)
+
+  def asDict(self):
+    return dict([(name, getattr(self, name)) for name in GameResult.__slots__])
+
+  def record(self):
+    "The result as (field, value) pairs, in a fixed order, for a results file."
+    return [(name, getattr(self, name)) for name in GameResult.__slots__]
+
+  def __str__(self):
+    return 'Game %d: %s, score %d in %d moves' % (self.index, ['Loss', 'Win'][self.win], self.score, self.moves)
+
+def simulateGame(rules, lay, pacmanAgent, ghosts, catchExceptions=False):
+  """
+  Plays one game headless and returns the finished Game.  Observations
+  are the game's own states rather than deep copies; agents that need a
+  private copy can take one in an observationFunction.
+  """
+  game = rules.newGame(lay, pacmanAgent, ghosts, textDisplay.NullGraphics(), True, catchExceptions)
+  game.copyObservations = False
+  game.run()
+  return game
+
+def iterateGames(lay, pacmanAgent, ghosts, numGames, catchExceptions=False, timeout=30):
+  "Plays numGames headless games, yielding each one's GameResult as soon as it ends."
+  rules = pacman.ClassicGameRules(timeout)
+  rules.quiet = True
+  for i in range(numGames):
+    start = time.time()
+    game = simulateGame(rules, lay, pacmanAgent, ghosts, catchExceptions)
+    yield GameResult(i, game, time.time() - start)
+
+def simulateGames(lay, pacmanAgent, ghosts, numGames, catchExceptions=False, timeout=30):
+  """
+  Plays numGames headless games and returns (results, games per second),
+  with one GameResult per game in the order they were played.  For long
+  runs, iterateGames avoids keeping the results.
+  """
+  start = time.time()
+  results = list(iterateGames(lay, pacmanAgent, ghosts, numGames, catchExceptions, timeout))
+  elapsed = time.time() - start
+  return results, numGames / max(elapsed, 1e-9)
+
+class ResultsSummary:
+  """
+  Running totals over a stream of GameResults, in constant memory: only
+  the first MAX_LISTED_GAMES games' scores and outcomes are kept, to list
+  them in the summary of a short run.
+  """
+
+  def __init__(self):
+    self.scores = util.RunningStats()
+    self.moves = util.RunningStats()
+    self.wins = 0
+    self.crashes = 0
+    self.agentTimes = []
+    self.listed = []
+
+  def add(self, result):
+    self.scores.add(result.score)
+    self.moves.add(result.moves)
+    if result.win: self.wins += 1
+    if result.crashed: self.crashes += 1
+    for i in range(len(self.agentTimes), len(result.agentTimes)):
+      self.agentTimes.append(0.0)
+    for i in range(len(result.agentTimes)):
+      self.agentTimes[i] += result.agentTimes[i]
+    if len(self.listed) < MAX_LISTED_GAMES:
+      self.listed.append((result.score, result.win))
+
+  def getNumGames(self):
+    return self.scores.count
+
+  def printSummary(self):
+    numGames = self.getNumGames()
+    listAll = numGames <= MAX_LISTED_GAMES
+    print 'Average Score:', self.scores.mean
+    if listAll:
+      print 'Scores:       ', ', '.join([str(score) for score, win in self.listed])
+    print 'Win Rate:      %d/%d (%.2f)' % (self.wins, numGames, self.wins / float(max(numGames, 1)))
+    if listAll:
+      print 'Record:       ', ', '.join([ ['Loss', 'Win'][int(win)] for score, win in self.listed])
+
+class JsonLinesWriter:
+  "Writes each record as one JSON object per line."
+
+  def __init__(self, f):
+    self.file = f
+
+  def write(self, record):
+    self.file.write(json.dumps(OrderedDict(record)) + '\n')
+
+  def close(self):
+    self.file.close()
+
+class CsvWriter:
+  """
+  Writes records as CSV rows, with a header row taken from the first
+  record's fields.  List and tuple values go in one column, space separated.
+  """
+
+  def __init__(self, f):
+    self.file = f
+    self.writer = csv.writer(f)
+    self.header = None
+
+  def write(self, record):
+    if self.header == None:
+      self.header = [name for name, value in record]
+      self.writer.writerow(self.header)
+    row = []
+    for name, value in record:
+      if type(value) in (list, tuple):
+        value = ' '.join([str(item) for item in value])
+      row.append(value)
+    self.writer.writerow(row)
+
+  def close(self):
+    self.file.close()
+
+def openResultsWriter(filename):
+  "A results writer for filename: CSV if it ends in .csv, otherwise JSON lines."
+  if filename.endswith('.csv'):
+    return CsvWriter(open(filename, 'wb'))
+  return JsonLinesWriter(open(filename, 'w'))
+
+def readCommand(argv):
+  from optparse import OptionParser
+  parser = OptionParser(__doc__)
+  parser.add_option('-n', '--numGames', dest='numGames', type='int', default=100,
+                    help=pacman.default('the number of GAMES to play'), metavar='GAMES')
+  parser.add_option('-l', '--layout', dest='layout', default='mediumClassic',
+                    help=pacman.default('the LAYOUT_FILE from which to load the map layout'))
+  parser.add_option('-p', '--pacman', dest='pacman', default='ReflexAgent',
+                    help=pacman.default('the agent TYPE in the pacmanAgents module to use'))
+  parser.add_option('-a', '--agentArgs', dest='agentArgs',
+                    help='Comma separated values sent to agent. e.g. "opt1=val1,opt2,opt3=val3"')
+  parser.add_option('-g', '--ghosts', dest='ghost', default='RandomGhost',
+                    help=pacman.default('the ghost agent TYPE in the ghostAgents module to use'))
+  parser.add_option('-k', '--numghosts', type='int', dest='numGhosts', default=4,
+                    help=pacman.default('The maximum number of ghosts to use'))
+  parser.add_option('-f', '--fixRandomSeed', action='store_true', dest='fixRandomSeed', default=False,
+                    help='Fixes the random seed to always play the same games')
+  parser.add_option('-c', '--catchExceptions', action='store_true', dest='catchExceptions', default=False,
+                    help='Turns on exception handling and timeouts during games')
+  parser.add_option('--timeout', dest='timeout', type='int', default=30,
+                    help=pacman.default('Maximum length of time an agent can spend computing in a single game'))
+  parser.add_option('-o', '--results', dest='results', default=None,
+                    help='A file to stream one record per game to, as CSV if it ends in .csv, else JSON lines')
+  options, otherjunk = parser.parse_args(argv)
+  if len(otherjunk) != 0:
+    raise Exception('Command line input not understood: ' + str(otherjunk))
+  return options
+
+if __name__ == '__main__':
+  options = readCommand(sys.argv[1:])
+  if options.fixRandomSeed: random.seed('cs188')
+  lay = layout.getLayout(options.layout)
+  if lay == None: raise Exception("The layout " + options.layout + " cannot be found")
+  pacmanAgent = pacman.loadAgent(options.pacman, True)(**pacman.parseAgentArgs(options.agentArgs))
+  ghostType = pacman.loadAgent(options.ghost, True)
+  ghosts = [ghostType(i + 1) for i in range(options.numGhosts)]
+  summary = ResultsSummary()
+  writer = None
+  if options.results != None: writer = openResultsWriter(options.results)
+  start = time.time()
+  try:
+    for result in iterateGames(lay, pacmanAgent, ghosts, options.numGames, options.catchExceptions, options.timeout):
+      summary.add(result)
+      if writer != None: writer.write(result.record())
+  finally:
+    if writer != None: writer.close()
+  elapsed = time.time() - start
+  print 'Games:         %d (%.1f games/s)' % (summary.getNumGames(), summary.getNumGames() / max(elapsed, 1e-9))
+  summary.printSummary()
+  print 'Average Moves: %.1f' % summary.moves.mean
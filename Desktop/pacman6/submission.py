@@ -1,9 +1,20 @@
-from util import manhattanDistance
-from game import Directions
-import random, util
+from util import manhattanDistance, nearestPoint
+from game import Directions, Actions
+from game import GameStateData
+import random, util, time, math
+import layout
+import ghostAgents
 
 from game import Agent
 
+# Nothing is imported from pacman at load time, so loading this module
+# never loads pacman.py a second time; functions import it when they run.
+try:
+    import numpy
+    NUMPY_ENABLED = True
+except ImportError:
+    NUMPY_ENABLED = False
+
 class ReflexAgent(Agent):
 
     def getAction(self, gameState):
@@ -16,6 +27,8 @@ class ReflexAgent(Agent):
 
     def evaluationFunction(self, currentGameState, action):
         successorGameState = currentGameState.generatePacmanSuccessor(action)
+        if NUMPY_ENABLED:
+            return numpyReflexEvaluation(successorGameState)
 	newPos = successorGameState.getPacmanPosition()
 	currentpos= currentGameState.getPacmanPosition()
 	newFood = successorGameState.getFood()
@@ -39,25 +52,302 @@ class ReflexAgent(Agent):
 def scoreEvaluationFunction(currentGameState):
     return currentGameState.getScore()
 
+def numpyReflexEvaluation(currentGameState):
+    """
+    ReflexAgent's features, vectorized: the score plus the reciprocal
+    Manhattan distance to every food pellet and to every ghost further
+    than one step away.
+    """
+    pos = numpy.array(currentGameState.getPacmanPosition(), dtype=float)
+    score = currentGameState.getScore()
+    foodDists = numpy.abs(currentGameState.getFoodArray() - pos).sum(axis=1)
+    score += (1.0 / foodDists[foodDists != 0]).sum()
+    ghostDists = numpy.abs(currentGameState.getGhostPositionArray() - pos).sum(axis=1)
+    score += (1.0 / ghostDists[ghostDists > 1]).sum()
+    return float(score)
+
+def numpyFeatureEvaluation(currentGameState):
+    """
+    The score, plus a pull towards the nearest food and towards scared
+    ghosts that can still be caught, minus a penalty for active ghosts
+    within two steps.
+    """
+    pos = numpy.array(currentGameState.getPacmanPosition(), dtype=float)
+    score = currentGameState.getScore()
+    food = currentGameState.getFoodArray()
+    if len(food):
+        score -= 1.5 * numpy.abs(food - pos).sum(axis=1).min()
+    ghostDists = numpy.abs(currentGameState.getGhostPositionArray() - pos).sum(axis=1)
+    scared = currentGameState.getScaredTimerArray()
+    active = scared == 0
+    score -= (20.0 * (ghostDists[active] <= 2)).sum()
+    chase = ~active & (scared > ghostDists)
+    score += (10.0 / (ghostDists[chase] + 1)).sum()
+    return float(score)
+
+def _stackFood(states):
+    """
+    Every state's food as one (total, 2) array, with the index of the
+    state each row belongs to and the number of rows per state.
+    """
+    foods = [state.getFoodArray() for state in states]
+    counts = numpy.array([len(food) for food in foods])
+    owner = numpy.repeat(numpy.arange(len(states)), counts)
+    return numpy.concatenate(foods), owner, counts
+
+def _stackGhosts(states, positions):
+    "The (batch, numGhosts) Manhattan distances from each state's Pacman to its ghosts."
+    ghosts = numpy.array([state.getGhostPositions() for state in states], dtype=float)
+    ghosts = ghosts.reshape(len(states), states[0].getNumAgents() - 1, 2)
+    return numpy.abs(ghosts - positions[:, None, :]).sum(axis=2)
+
+def numpyReflexBatch(states):
+    "numpyReflexEvaluation over a batch of states, as one array of scores."
+    positions = numpy.array([state.getPacmanPosition() for state in states], dtype=float)
+    scores = numpy.array([state.getScore() for state in states], dtype=float)
+    food, owner, counts = _stackFood(states)
+    foodDists = numpy.abs(food - positions[owner]).sum(axis=1)
+    near = foodDists != 0
+    scores += numpy.bincount(owner[near], weights=1.0 / foodDists[near], minlength=len(states))
+    ghostDists = _stackGhosts(states, positions)
+    far = ghostDists > 1
+    scores += numpy.where(far, 1.0 / numpy.where(far, ghostDists, 1), 0).sum(axis=1)
+    return scores
+
+def numpyFeatureBatch(states):
+    "numpyFeatureEvaluation over a batch of states, as one array of scores."
+    positions = numpy.array([state.getPacmanPosition() for state in states], dtype=float)
+    scores = numpy.array([state.getScore() for state in states], dtype=float)
+    food, owner, counts = _stackFood(states)
+    if len(food):
+        foodDists = numpy.abs(food - positions[owner]).sum(axis=1)
+        starts = (numpy.cumsum(counts) - counts)[counts > 0]
+        scores[counts > 0] -= 1.5 * numpy.minimum.reduceat(foodDists, starts)
+    ghostDists = _stackGhosts(states, positions)
+    scared = numpy.array([state.getScaredTimerArray() for state in states], dtype=int).reshape(ghostDists.shape)
+    active = scared == 0
+    scores -= (20.0 * (active & (ghostDists <= 2))).sum(axis=1)
+    chase = ~active & (scared > ghostDists)
+    scores += numpy.where(chase, 10.0 / (ghostDists + 1), 0).sum(axis=1)
+    return scores
+
+numpyReflexEvaluation.evaluateBatch = numpyReflexBatch
+numpyFeatureEvaluation.evaluateBatch = numpyFeatureBatch
+
+class BatchEvaluationFunction:
+    """
+    Turns a function from a list of states to an array of values into an
+    evaluation function: calling it scores a single state, and
+    evaluateBatch is the wrapped function itself.
+    """
+
+    def __init__(self, evaluateBatch):
+        self.evaluateBatch = evaluateBatch
+
+    def __call__(self, currentGameState):
+        return self.evaluateBatch([currentGameState])[0]
+
+EVALUATION_FUNCTIONS = {}
+
+def registerEvaluationFunction(name, function, needsNumpy=False):
+    "Makes function selectable as MultiAgentSearchAgent(evalFn=name)."
+    EVALUATION_FUNCTIONS[name] = (function, needsNumpy)
+
+def getEvaluationFunction(name):
+    """
+    Looks name up in the registry first, then as a function or class name
+    anywhere in this module's namespace.
+    """
+    if name not in EVALUATION_FUNCTIONS:
+        return util.lookup(name, globals())
+    function, needsNumpy = EVALUATION_FUNCTIONS[name]
+    if needsNumpy and not NUMPY_ENABLED:
+        raise Exception('The evaluation function %s requires numpy' % name)
+    return function
+
+registerEvaluationFunction('score', scoreEvaluationFunction)
+registerEvaluationFunction('numpyReflex', numpyReflexEvaluation, needsNumpy=True)
+registerEvaluationFunction('numpyFeatures', numpyFeatureEvaluation, needsNumpy=True)
+
+MAX_ITERATIVE_DEPTH = 100
+MOVE_TIMEOUT_SAFETY = 0.9
+
+class SearchTimeout(Exception):
+    "Raised from inside a search when the move deadline has passed."
+    pass
+
+_workerAgent = None
+_workerLayout = None
+
+def _initWorker(agent, layoutText):
+    global _workerAgent, _workerLayout
+    _workerAgent = agent
+    _workerAgent.workers = 0
+    _workerLayout = layout.Layout(layoutText)
+
+def _searchRootAction(job):
+    "Worker side of a root split: the value of Pacman playing action, or None on timeout."
+    packed, action, depth, deadline = job
+    import pacman
+    state = pacman.GameState()
+    state.data = GameStateData.unpack(_workerLayout, packed)
+    _workerAgent.deadline = deadline
+    try:
+        return _workerAgent.getRootValue(state.generateSuccessor(0, action), depth)
+    except SearchTimeout:
+        return None
+    finally:
+        _workerAgent.deadline = None
+
 class MultiAgentSearchAgent(Agent):
+    """
+    With timeLimit > 0 (seconds) the agents search iteratively deeper until
+    the move deadline, instead of to the fixed depth.  The deadline is the
+    smaller of timeLimit and a safe fraction of the time left before the
+    game's timeout: the rules' move timeout, which Game.run reports
+    through setMoveTimeout, or util.getCallDeadline during a timed call.
+
+    With workers > 0 each of Pacman's root moves is searched in a pool of
+    that many processes, started once per game and stopped when the game
+    ends, even by a crash or timeout.  States travel to the
+    workers as GameStateData.pack() tuples; the layout is sent once, when
+    the pool starts.
+
+    Leaves are scored in batches through evaluateLeaves: one call to the
+    evaluation function's evaluateBatch(states) per batch if it has one
+    (see BatchEvaluationFunction), and otherwise a loop over the states.
+    """
     
-    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '4'):
+    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '4', tableSize = '100000', timeLimit = '0',
+                 workers = '0'):
         self.index = 0 
-        self.evaluationFunction = util.lookup(evalFn, globals())
+        self.evaluationFunction = getEvaluationFunction(evalFn)
+        self.leafBatches = 0
+        self.leavesEvaluated = 0
         self.depth = int(depth)
+        self.tableSize = int(tableSize)
+        self.transpositionTable = None
+        if self.tableSize > 0:
+            self.transpositionTable = util.TranspositionTable(self.tableSize)
+        self.timeLimit = float(timeLimit)
+        self.moveTimeout = None
+        self.deadline = None
+        self.completedDepth = 0
+        self.workers = int(workers)
+        self.pool = None
+        self.poolLayout = None
 	self.action1 = Directions.STOP
 	self.value_max = -99999
 	self.value_min = 99999
 	self.value_avg = 99999
 
+    def evaluateLeaves(self, states):
+        "The evaluation function's values for states, as a list."
+        self.leafBatches += 1
+        self.leavesEvaluated += len(states)
+        function = self.evaluationFunction
+        if not hasattr(function, 'evaluateBatch'):
+            return [function(state) for state in states]
+        values = function.evaluateBatch(states)
+        if NUMPY_ENABLED and isinstance(values, numpy.ndarray):
+            return values.tolist()
+        return values
+
+    def setMoveTimeout(self, seconds):
+        self.moveTimeout = seconds
+
+    def getTimeBudget(self):
+        budget = self.timeLimit
+        if self.moveTimeout != None:
+            budget = min(budget, self.moveTimeout * MOVE_TIMEOUT_SAFETY)
+        # Inside a timed call the game's own deadline, which already
+        # accounts for the observation time, caps the budget too.
+        callDeadline = util.getCallDeadline()
+        if callDeadline != None:
+            budget = min(budget, (callDeadline - time.time()) * MOVE_TIMEOUT_SAFETY)
+        return budget
+
+    def checkDeadline(self):
+        if self.deadline != None and time.time() > self.deadline:
+            raise SearchTimeout()
+
+    def registerInitialState(self, gameState):
+        if self.workers > 0:
+            self.startWorkers(gameState)
+
+    def final(self, gameState):
+        self.stopWorkers()
+
+    def cleanup(self):
+        "Called by Game.run however the game ends, so the pool never outlives it."
+        self.stopWorkers()
+
+    def startWorkers(self, gameState):
+        import multiprocessing
+        self.stopWorkers()
+        layoutText = gameState.data.layout.layoutText
+        self.pool = multiprocessing.Pool(self.workers, _initWorker, (self, layoutText))
+        self.poolLayout = layoutText
+
+    def stopWorkers(self):
+        if self.pool != None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def search(self, gameState):
+        "Picks Pacman's move, honouring the timeLimit and workers options."
+        searchToDepth = self.searchToDepth
+        if self.workers > 0:
+            searchToDepth = self.parallelSearchToDepth
+        if self.timeLimit > 0:
+            return self.iterativeDeepening(gameState, searchToDepth)
+        return searchToDepth(gameState, self.depth)
+
+    def parallelSearchToDepth(self, gameState, depth):
+        if self.pool == None or self.poolLayout != gameState.data.layout.layoutText:
+            self.startWorkers(gameState)
+        actions = gameState.getLegalActions(0)
+        packed = gameState.data.pack()
+        values = self.pool.map(_searchRootAction, [(packed, action, depth, self.deadline) for action in actions])
+        if None in values:
+            raise SearchTimeout()
+        # Ties go to the largest action, as in MinimaxAgent's own search.
+        self.value_max, self.action1 = max(zip(values, actions))
+        return self.action1
+
+    def iterativeDeepening(self, gameState, searchToDepth):
+        """
+        Calls searchToDepth(gameState, depth) for depth = 1, 2, ... until the
+        deadline and returns the action of the deepest search that finished.
+        """
+        self.deadline = time.time() + self.getTimeBudget()
+        self.completedDepth = 0
+        action = gameState.getLegalActions(0)[0]
+        try:
+            for depth in range(1, MAX_ITERATIVE_DEPTH + 1):
+                action = searchToDepth(gameState, depth)
+                self.completedDepth = depth
+        except SearchTimeout:
+            pass
+        finally:
+            self.deadline = None
+        return action
+
 class MinimaxAgent(MultiAgentSearchAgent):
     def getAction(self, gameState):
+	return self.search(gameState)
+
+    def getRootValue(self, successor, depth):
+	num_of_agents = successor.getNumAgents()
+	return self.getValue(successor, depth * num_of_agents - 1, num_of_agents)
+
+    def searchToDepth(self, gameState, depth):
 	num_of_agents = gameState.getNumAgents()
-	depth1 = self.depth * num_of_agents	
+	depth1 = depth * num_of_agents	
 
 	self.getAction1(gameState,depth1,num_of_agents)
 	return self.action1		
-	util.raiseNotDefined()
 
     def maxvalue(self ,state, agentIndex, currentdepth):
       v = (float("-inf"), "Stop")
@@ -80,6 +370,56 @@ class MinimaxAgent(MultiAgentSearchAgent):
       else:
         return self.minvalue(state, agentIndex, currentdepth)[0]
     
+    def getValue(self, gameState, depth1, num_of_agents):
+	table = self.transpositionTable
+	if table == None or depth1 == 0 or gameState.isWin() or gameState.isLose():
+		return self.computeValue(gameState, depth1, num_of_agents)
+	key = (hash(gameState), depth1 % num_of_agents)
+	value = table.lookup(key, depth1)
+	if value == None:
+		value = self.computeValue(gameState, depth1, num_of_agents)
+		table.store(key, depth1, value)
+	return value
+
+    def computeValue(self, gameState, depth1, num_of_agents):
+	"""
+	Searches the last round of plies as one batch: every leaf of the
+	subtree is collected first and evaluated with a single evaluateLeaves
+	call.
+	"""
+	if depth1 > num_of_agents:
+		return self.getAction1(gameState, depth1, num_of_agents)
+	self.checkDeadline()
+	leaves = []
+	tree = self.collectLeaves(gameState, depth1, num_of_agents, leaves)
+	return self.backUp(tree, self.evaluateLeaves(leaves))
+
+    def collectLeaves(self, gameState, depth1, num_of_agents, leaves):
+	"""
+	Appends the leaves of gameState's subtree to leaves and returns its
+	shape: a leaf's index in leaves, or (agentNumber, child subtrees).
+	"""
+	if gameState.isWin() or gameState.isLose() or depth1 == 0:
+		leaves.append(gameState)
+		return len(leaves) - 1
+	if depth1%num_of_agents == 0:
+		agentNumber = 0
+	else:
+		agentNumber = num_of_agents-(depth1%num_of_agents)
+	children = [self.collectLeaves(gameState.generateSuccessor(agentNumber, action), depth1-1, num_of_agents, leaves)
+		    for action in gameState.getLegalActions(agentNumber)]
+	return (agentNumber, children)
+
+    def backUp(self, tree, values):
+	"The minimax value of a collectLeaves subtree, given the values of its leaves."
+	if type(tree) == int:
+		return values[tree]
+	agentNumber, children = tree
+	childValues = [self.backUp(child, values) for child in children]
+	if agentNumber == 0:
+		return max(childValues)
+	return min(childValues)
+
     def getAction1(self,gameState,depth1,num_of_agents):
 	maxvalues = list()
 	minvalues = list()
@@ -87,6 +427,7 @@ class MinimaxAgent(MultiAgentSearchAgent):
 		return self.evaluationFunction(gameState)
 			
 	if depth1 > 0:
+		self.checkDeadline()
 		if depth1%num_of_agents ==0:
 			agentNumber = 0
 				
@@ -98,13 +439,13 @@ class MinimaxAgent(MultiAgentSearchAgent):
 			successorGameState = gameState.generateSuccessor(agentNumber,action)
 			 
 			if agentNumber == 0: 
-				maxvalues.append((self.getAction1(successorGameState,depth1-1,num_of_agents), action))			
+				maxvalues.append((self.getValue(successorGameState,depth1-1,num_of_agents), action))			
 				maximum = max(maxvalues) 
 				self.value_max = maximum[0]
 				self.action1=maximum[1]				
 				
 			else:	
-				minvalues.append((self.getAction1(successorGameState,depth1-1,num_of_agents), action))			
+				minvalues.append((self.getValue(successorGameState,depth1-1,num_of_agents), action))			
 				minimum = min(minvalues)
 				self.value_min = minimum[0]
 			
@@ -116,3 +457,441 @@ class MinimaxAgent(MultiAgentSearchAgent):
 	else:
 		return self.evaluationFunction(gameState) 
 
+
+class AlphaBetaAgent(MultiAgentSearchAgent):
+    """
+    Minimax with alpha-beta pruning over Pacman's max layer and every ghost's
+    min layer.  Moves are tried in the order: the best move previously found
+    from the same position, the killer moves that caused cutoffs at the same
+    ply, then by history score.  Pruning is strict, so a root move's value
+    is exact whenever it ties the best so far; root ties go to the largest
+    action, as in MinimaxAgent, and the move chosen is MinimaxAgent's too.
+
+    Evaluating a leaf batch gives up the cutoffs between its leaves, so
+    leaves are only batched, one last-ply node's children at a time, when
+    the evaluation function has its own evaluateBatch.
+    """
+
+    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '4', tableSize = '100000', timeLimit = '0',
+                 workers = '0'):
+        MultiAgentSearchAgent.__init__(self, evalFn, depth, tableSize, timeLimit, workers)
+        # Alpha-beta values are bounds, so only the best move per position
+        # is remembered (up to tableSize of them), not a value table.
+        self.transpositionTable = None
+        self.bestMoves = {}
+        self.history = util.Counter()
+        self.killers = {}
+        self.nodesExpanded = 0
+        self.nodesGenerated = 0
+        self.cutoffs = 0
+        self.batchLeaves = hasattr(self.evaluationFunction, 'evaluateBatch')
+
+    def getAction(self, gameState):
+        if len(self.bestMoves) > self.tableSize:
+            self.bestMoves.clear()
+        for key in self.history.keys():
+            self.history[key] /= 2
+        self.killers = {}
+        return self.search(gameState)
+
+    def searchToDepth(self, gameState, depth):
+        self.value_max, self.action1 = self.alphaBeta(gameState, 0, depth * gameState.getNumAgents(),
+                                                      float("-inf"), float("inf"))
+        return self.action1
+
+    def getRootValue(self, successor, depth):
+        return self.alphaBeta(successor, 1, depth * successor.getNumAgents(), float("-inf"), float("inf"))[0]
+
+    def orderActions(self, actions, agentIndex, ply, bestMove):
+        killers = self.killers.get(ply, ())
+        history = self.history
+        return sorted(actions, key=lambda action: (action != bestMove, action not in killers,
+                                                   -history[(agentIndex, action)]))
+
+    def recordCutoff(self, agentIndex, ply, action, depthLeft):
+        self.cutoffs += 1
+        killers = self.killers.setdefault(ply, [])
+        if action not in killers:
+            killers.insert(0, action)
+            del killers[2:]
+        self.history[(agentIndex, action)] += depthLeft * depthLeft
+
+    def alphaBeta(self, state, ply, maxPly, alpha, beta):
+        "Returns (value, best action) of state searched to maxPly plies."
+        if state.isWin() or state.isLose() or ply == maxPly:
+            return self.evaluationFunction(state), None
+
+        self.checkDeadline()
+        numAgents = state.getNumAgents()
+        agentIndex = ply % numAgents
+        key = (hash(state), agentIndex)
+        actions = self.orderActions(state.getLegalActions(agentIndex), agentIndex, ply, self.bestMoves.get(key))
+        self.nodesExpanded += 1
+
+        leafValues = None
+        if self.batchLeaves and ply == maxPly - 1:
+            self.nodesGenerated += len(actions)
+            leafValues = self.evaluateLeaves([state.generateSuccessor(agentIndex, action) for action in actions])
+
+        bestAction = None
+        if agentIndex == 0:
+            best = float("-inf")
+            for i in range(len(actions)):
+                action = actions[i]
+                if leafValues == None:
+                    self.nodesGenerated += 1
+                    value = self.alphaBeta(state.generateSuccessor(agentIndex, action), ply + 1, maxPly, alpha, beta)[0]
+                else:
+                    value = leafValues[i]
+                if value > best or (ply == 0 and value == best and action > bestAction):
+                    best, bestAction = value, action
+                if best > beta:
+                    self.recordCutoff(agentIndex, ply, action, maxPly - ply)
+                    break
+                alpha = max(alpha, best)
+        else:
+            best = float("inf")
+            for i in range(len(actions)):
+                action = actions[i]
+                if leafValues == None:
+                    self.nodesGenerated += 1
+                    value = self.alphaBeta(state.generateSuccessor(agentIndex, action), ply + 1, maxPly, alpha, beta)[0]
+                else:
+                    value = leafValues[i]
+                if value < best:
+                    best, bestAction = value, action
+                if best < alpha:
+                    self.recordCutoff(agentIndex, ply, action, maxPly - ply)
+                    break
+                beta = min(beta, best)
+
+        self.bestMoves[key] = bestAction
+        return best, bestAction
+
+class ExpectimaxAgent(MultiAgentSearchAgent):
+    """
+    Expectimax against a model of the ghosts: each chance node weights the
+    ghost's moves by ghostType's getDistribution.  Chance-node expectations
+    are cached in the transposition table by state hash, together with the
+    range of leaf values under them.
+
+    Ghost moves with probability below pruneThreshold are skipped and the
+    rest renormalized.  lostMass accumulates the skipped probability down
+    the tree, and errorBound = lostMass * the spread of leaf values seen
+    bounds the root's error as long as the skipped subtrees score within
+    that spread.
+
+    The last round of plies below the root is searched as one batch: its
+    leaves are collected first and evaluated with a single evaluateLeaves
+    call.
+    """
+
+    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '4', tableSize = '100000',
+                 ghostType = 'RandomGhost', pruneThreshold = '0', timeLimit = '0', workers = '0'):
+        MultiAgentSearchAgent.__init__(self, evalFn, depth, tableSize, timeLimit, workers)
+        self.ghostType = util.lookup(ghostType, globals())
+        self.ghostModels = {}
+        self.pruneThreshold = float(pruneThreshold)
+        self.prunedBranches = 0
+        self.lostMass = 0.0
+        self.errorBound = 0.0
+
+    def getAction(self, gameState):
+        return self.search(gameState)
+
+    def searchToDepth(self, gameState, depth):
+        self.minLeaf, self.maxLeaf = float("inf"), float("-inf")
+        value, self.lostMass, self.action1 = self.expectimax(gameState, 0, depth * gameState.getNumAgents())
+        self.value_max = value
+        self.errorBound = 0.0
+        if self.lostMass > 0:
+            self.errorBound = self.lostMass * (self.maxLeaf - self.minLeaf)
+        return self.action1
+
+    def getRootValue(self, successor, depth):
+        self.minLeaf, self.maxLeaf = float("inf"), float("-inf")
+        return self.expectimax(successor, 1, depth * successor.getNumAgents())[0]
+
+    def getGhostModel(self, agentIndex):
+        if agentIndex not in self.ghostModels:
+            self.ghostModels[agentIndex] = self.ghostType(agentIndex)
+        return self.ghostModels[agentIndex]
+
+    def expectimax(self, state, ply, maxPly):
+        "Returns (value, lost probability mass, best action) of state searched to maxPly plies."
+        if state.isWin() or state.isLose() or ply == maxPly:
+            value = self.evaluationFunction(state)
+            self.minLeaf = min(self.minLeaf, value)
+            self.maxLeaf = max(self.maxLeaf, value)
+            return value, 0.0, None
+
+        self.checkDeadline()
+        numAgents = state.getNumAgents()
+        agentIndex = ply % numAgents
+        batch = ply > 0 and maxPly - ply <= numAgents
+        if agentIndex == 0:
+            if batch:
+                value, mass = self.expectimaxBatch(state, ply, maxPly)
+                return value, mass, None
+            best, bestMass, bestAction = float("-inf"), 0.0, None
+            for action in state.getLegalActions(0):
+                value, mass, _ = self.expectimax(state.generateSuccessor(0, action), ply + 1, maxPly)
+                if value > best or (ply == 0 and value == best and action > bestAction):
+                    best, bestAction = value, action
+                bestMass = max(bestMass, mass)
+            return best, bestMass, bestAction
+
+        table = self.transpositionTable
+        if table != None:
+            key = (hash(state), agentIndex)
+            cached = table.lookup(key, maxPly - ply)
+            if cached != None:
+                value, mass, minLeaf, maxLeaf = cached
+                self.minLeaf = min(self.minLeaf, minLeaf)
+                self.maxLeaf = max(self.maxLeaf, maxLeaf)
+                return value, mass, None
+            outerMin, outerMax = self.minLeaf, self.maxLeaf
+            self.minLeaf, self.maxLeaf = float("inf"), float("-inf")
+
+        if batch:
+            value, mass = self.expectimaxBatch(state, ply, maxPly)
+        else:
+            kept, keptMass = self.chanceBranches(state, agentIndex)
+            value, mass = 0.0, 1.0 - keptMass
+            for p, action in kept:
+                childValue, childMass, _ = self.expectimax(state.generateSuccessor(agentIndex, action), ply + 1, maxPly)
+                value += p / keptMass * childValue
+                mass += p / keptMass * childMass
+        if table != None:
+            table.store(key, maxPly - ply, (value, mass, self.minLeaf, self.maxLeaf))
+            self.minLeaf = min(self.minLeaf, outerMin)
+            self.maxLeaf = max(self.maxLeaf, outerMax)
+        return value, mass, None
+
+    def chanceBranches(self, state, agentIndex):
+        "The (probability, action) pairs searched at a chance node, and their total probability."
+        dist = self.getGhostModel(agentIndex).getDistribution(state)
+        branches = [(dist[action], action) for action in state.getLegalActions(agentIndex) if dist[action] > 0]
+        kept = [(p, action) for p, action in branches if p >= self.pruneThreshold]
+        if len(kept) == 0:
+            kept = [max(branches)]
+        self.prunedBranches += len(branches) - len(kept)
+        return kept, sum([p for p, action in kept])
+
+    def expectimaxBatch(self, state, ply, maxPly):
+        "Returns (value, lost probability mass) of state, evaluating all its leaves as one batch."
+        leaves = []
+        tree = self.collectLeaves(state, ply, maxPly, leaves)
+        values = self.evaluateLeaves(leaves)
+        self.minLeaf = min(self.minLeaf, min(values))
+        self.maxLeaf = max(self.maxLeaf, max(values))
+        return self.backUp(tree, values)
+
+    def collectLeaves(self, state, ply, maxPly, leaves):
+        """
+        Appends the leaves of state's subtree to leaves and returns its
+        shape: a leaf's index in leaves, or (child weights, lost mass, child
+        subtrees), with weights None at Pacman's nodes.
+        """
+        if state.isWin() or state.isLose() or ply == maxPly:
+            leaves.append(state)
+            return len(leaves) - 1
+        agentIndex = ply % state.getNumAgents()
+        if agentIndex == 0:
+            return (None, 0.0, [self.collectLeaves(state.generateSuccessor(0, action), ply + 1, maxPly, leaves)
+                                for action in state.getLegalActions(0)])
+        kept, keptMass = self.chanceBranches(state, agentIndex)
+        return ([p / keptMass for p, action in kept], 1.0 - keptMass,
+                [self.collectLeaves(state.generateSuccessor(agentIndex, action), ply + 1, maxPly, leaves)
+                 for p, action in kept])
+
+    def backUp(self, tree, values):
+        "The (value, lost probability mass) of a collectLeaves subtree, given the values of its leaves."
+        if type(tree) == int:
+            return values[tree], 0.0
+        weights, lostMass, children = tree
+        results = [self.backUp(child, values) for child in children]
+        if weights == None:
+            return max([childValue for childValue, childMass in results]), max([childMass for childValue, childMass in results])
+        value, mass = 0.0, lostMass
+        for weight, (childValue, childMass) in zip(weights, results):
+            value += weight * childValue
+            mass += weight * childMass
+        return value, mass
+
+class RolloutSimulator:
+    """
+    A stripped-down copy of the Pacman rules for fast MCTS rollouts.  Agents
+    are plain (x, y) tuples moving over precomputed neighbor lists, food is
+    the Grid bitboard, and scared ghosts move at full speed, which is the
+    one simplification relative to PacmanRules/GhostRules.
+    """
+
+    def __init__(self, walls):
+        import pacman
+        self.timePenalty = pacman.TIME_PENALTY
+        self.scaredTime = pacman.SCARED_TIME
+        self.height = walls.height
+        self.neighbors = {}
+        for x in range(walls.width):
+            for y in range(walls.height):
+                if walls[x][y]: continue
+                moves = []
+                for action in [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST]:
+                    dx, dy = Actions.directionToVector(action)
+                    next = (x + int(dx), y + int(dy))
+                    if not walls[next[0]][next[1]]: moves.append((action, next))
+                self.neighbors[(x, y)] = moves
+
+    def rollout(self, state, numMoves, greedy=False):
+        "Plays numMoves random rounds from state and returns the final score."
+        data = state.data
+        neighbors, height = self.neighbors, self.height
+        pacman = nearestPoint(data.agentStates[0].getPosition())
+        ghosts = [nearestPoint(ghost.getPosition()) for ghost in data.agentStates[1:]]
+        starts = [ghost.start.getPosition() for ghost in data.agentStates[1:]]
+        directions = [ghost.getDirection() for ghost in data.agentStates[1:]]
+        scared = [ghost.scaredTimer for ghost in data.agentStates[1:]]
+        food = data.food.bits
+        numFood = bin(food).count('1')
+        capsules = list(data.capsules)
+        score = data.score
+
+        for move in range(numMoves):
+            moves = neighbors[pacman]
+            if greedy:
+                eating = [m for m in moves if (food >> (m[1][0] * height + m[1][1])) & 1]
+                if eating: moves = eating
+            pacman = random.choice(moves)[1]
+            score -= self.timePenalty
+            bit = 1 << (pacman[0] * height + pacman[1])
+            if food & bit:
+                food ^= bit
+                score += 10
+                numFood -= 1
+                if numFood == 0: return score + 500
+            if pacman in capsules:
+                capsules.remove(pacman)
+                scared = [self.scaredTime] * len(ghosts)
+
+            for i in range(len(ghosts)):
+                if ghosts[i] != pacman:
+                    moves = neighbors[ghosts[i]]
+                    if len(moves) > 1:
+                        reverse = Actions.reverseDirection(directions[i])
+                        moves = [m for m in moves if m[0] != reverse]
+                    directions[i], ghosts[i] = random.choice(moves)
+                    if scared[i] > 0: scared[i] -= 1
+                if ghosts[i] == pacman:
+                    if scared[i] > 0:
+                        score += 200
+                        ghosts[i], scared[i] = starts[i], 0
+                    else:
+                        return score - 500
+        return score
+
+_ROLLOUT_SIMULATORS = {}
+
+def getRolloutSimulator(walls):
+    key = (walls.width, walls.height, walls.bits)
+    if key not in _ROLLOUT_SIMULATORS:
+        _ROLLOUT_SIMULATORS[key] = RolloutSimulator(walls)
+    return _ROLLOUT_SIMULATORS[key]
+
+class MCTSNode:
+    "Statistics for one Pacman decision point, reached by a sequence of Pacman moves."
+
+    def __init__(self, actions):
+        self.untried = list(actions)
+        self.children = {}
+        self.visits = 0
+        self.totalReward = 0.0
+
+    def selectChild(self, exploration):
+        logVisits = math.log(self.visits)
+        def uct(item):
+            child = item[1]
+            return child.totalReward / child.visits + exploration * math.sqrt(logVisits / child.visits)
+        return max(self.children.items(), key=uct)
+
+class MCTSAgent(MultiAgentSearchAgent):
+    """
+    Monte Carlo tree search with UCT over Pacman's moves.  Ghost replies are
+    sampled uniformly on the way down the tree (open-loop), and leaves are
+    scored by RolloutSimulator.  Each move runs up to `iterations`
+    iterations, or until the time budget when timeLimit > 0.  The rollout
+    policy is 'random' or 'greedy' (prefers moves that eat food).
+
+    Rewards are score changes divided by REWARD_SCALE, so the exploration
+    constant works on roughly the scale of one death.
+    """
+    REWARD_SCALE = 500.0
+
+    def __init__(self, iterations = '1000', exploration = '1.0', rolloutDepth = '20',
+                 rolloutPolicy = 'random', timeLimit = '0'):
+        MultiAgentSearchAgent.__init__(self, tableSize = '0', timeLimit = timeLimit)
+        self.iterations = int(iterations)
+        self.exploration = float(exploration)
+        self.rolloutDepth = int(rolloutDepth)
+        if rolloutPolicy not in ['random', 'greedy']:
+            raise Exception('Unknown rollout policy: ' + rolloutPolicy)
+        self.greedyRollouts = rolloutPolicy == 'greedy'
+        self.totalIterations = 0
+        self.totalTime = 0.0
+        self.iterationsPerSecond = 0.0
+
+    def getAction(self, gameState):
+        simulator = getRolloutSimulator(gameState.getWalls())
+        root = MCTSNode(gameState.getLegalActions(0))
+        deadline = None
+        if self.timeLimit > 0:
+            deadline = time.time() + self.getTimeBudget()
+        start = time.time()
+        iteration = 0
+        while iteration < self.iterations or deadline != None:
+            if deadline != None and time.time() > deadline: break
+            self.runIteration(root, gameState, simulator)
+            iteration += 1
+        elapsed = time.time() - start
+        self.totalIterations += iteration
+        self.totalTime += elapsed
+        if elapsed > 0: self.iterationsPerSecond = iteration / elapsed
+
+        if len(root.children) == 0:
+            return root.untried[0]
+        return max(root.children.items(), key=lambda item: item[1].visits)[0]
+
+    def runIteration(self, root, state, simulator):
+        rootScore = state.getScore()
+        node, path = root, [root]
+        while not (state.isWin() or state.isLose()):
+            if not node.untried and not node.children:
+                # First made where a sampled ghost reply ended the game, so it has no moves yet.
+                node.untried = list(state.getLegalActions(0))
+            if node.untried:
+                action = node.untried.pop(random.randrange(len(node.untried)))
+                state = self.playRound(state, action)
+                child = MCTSNode(state.getLegalActions(0))
+                node.children[action] = child
+                path.append(child)
+                break
+            action, node = node.selectChild(self.exploration)
+            state = self.playRound(state, action)
+            path.append(node)
+
+        if state.isWin() or state.isLose():
+            score = state.getScore()
+        else:
+            score = simulator.rollout(state, self.rolloutDepth, self.greedyRollouts)
+        reward = (score - rootScore) / self.REWARD_SCALE
+        for node in path:
+            node.visits += 1
+            node.totalReward += reward
+
+    def playRound(self, state, action):
+        "Applies Pacman's action and a uniformly random reply from every ghost."
+        state = state.generateSuccessor(0, action)
+        for ghostIndex in range(1, state.getNumAgents()):
+            if state.isWin() or state.isLose(): break
+            state = state.generateSuccessor(ghostIndex, random.choice(state.getLegalActions(ghostIndex)))
+        return state
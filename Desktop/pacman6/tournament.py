@@ -0,0 +1,196 @@
+"""
+Tournaments: every combination of the given Pacman agents, ghost agents
+and layouts plays a number of games, spread over a pool of processes.
+Each game is seeded from its position in the tournament, so a tournament
+played with --fixRandomSeed gives the same results however many workers
+play it.
+
+USAGE:      python tournament.py <options>
+EXAMPLES:   (1) python tournament.py -p ReflexAgent -n 100 -w 4
+                - 100 games of ReflexAgent against RandomGhost on mediumClassic
+            (2) python tournament.py -p MinimaxAgent:depth=2 -p ExpectimaxAgent:depth=2
+                                     -g RandomGhost -g DirectionalGhost -n 50 -f
+                - a 2 x 2 matrix of matchups, 50 games each, reproducibly seeded
+"""
+import sys, time, random, hashlib
+import layout, pacman, util, simulation
+
+class Matchup(object):
+  "One cell of the tournament matrix: a Pacman agent, a ghost agent and a layout."
+  __slots__ = ('pacman', 'ghost', 'layoutName', 'numGhosts')
+
+  def __init__(self, pacman, ghost, layoutName, numGhosts):
+    self.pacman = pacman
+    self.ghost = ghost
+    self.layoutName = layoutName
+    self.numGhosts = numGhosts
+
+  def __getstate__(self):
+    return (self.pacman, self.ghost, self.layoutName, self.numGhosts)
+
+  def __setstate__(self, state):
+    self.pacman, self.ghost, self.layoutName, self.numGhosts = state
+
+  def __str__(self):
+    return '%s vs %s on %s' % (self.pacman, self.ghost, self.layoutName)
+
+class MatchupStats:
+  "Running win rate and score statistics of one matchup's finished games."
+
+  def __init__(self, matchup):
+    self.matchup = matchup
+    self.wins = util.RunningStats()
+    self.scores = util.RunningStats()
+    self.moves = util.RunningStats()
+    self.crashes = 0
+
+  def add(self, result):
+    self.wins.add(float(result.win))
+    self.scores.add(result.score)
+    self.moves.add(result.moves)
+    if result.crashed: self.crashes += 1
+
+  def row(self, width):
+    "One line of the standings table, with the matchup padded to width."
+    return '%-*s %6d  %.3f +- %.3f  %9.2f +- %7.2f  %8.2f  %7.1f' % \
+           (width, str(self.matchup), self.scores.count, self.wins.mean, self.wins.confidenceInterval(),
+            self.scores.mean, self.scores.confidenceInterval(), self.scores.stdDev(), self.moves.mean)
+
+def parseAgentSpec(spec):
+  "Splits 'AgentType:opt1=val1,opt2=val2' into the agent type and its keyword arguments."
+  if ':' not in spec:
+    return spec, {}
+  agentType, args = spec.split(':', 1)
+  return agentType, pacman.parseAgentArgs(args)
+
+def gameSeed(baseSeed, matchupIndex, gameIndex):
+  "A 32-bit seed for one game, fixed by the tournament's base seed and the game's place in it."
+  digest = hashlib.md5('%s:%d:%d' % (baseSeed, matchupIndex, gameIndex)).hexdigest()
+  return int(digest[:8], 16)
+
+_agentTypes = {}
+_layouts = {}
+
+def _loadAgentType(agentType):
+  if agentType not in _agentTypes:
+    _agentTypes[agentType] = pacman.loadAgent(agentType, True)
+  return _agentTypes[agentType]
+
+def _loadLayout(layoutName):
+  if layoutName not in _layouts:
+    lay = layout.getLayout(layoutName)
+    if lay == None: raise Exception("The layout " + layoutName + " cannot be found")
+    _layouts[layoutName] = lay
+  return _layouts[layoutName]
+
+def playTournamentGame(job):
+  """
+  Plays one game of a matchup with fresh agents, after seeding random
+  with the game's seed, and returns (matchupIndex, gameIndex, GameResult).
+  """
+  matchupIndex, gameIndex, matchup, seed, timeout, catchExceptions = job
+  random.seed(seed)
+  lay = _loadLayout(matchup.layoutName)
+  pacmanType, pacmanArgs = parseAgentSpec(matchup.pacman)
+  ghostType, ghostArgs = parseAgentSpec(matchup.ghost)
+  pacmanAgent = _loadAgentType(pacmanType)(**pacmanArgs)
+  ghosts = [_loadAgentType(ghostType)(i + 1, **ghostArgs) for i in range(matchup.numGhosts)]
+  rules = pacman.ClassicGameRules(timeout)
+  start = time.time()
+  game = simulation.simulateGame(rules, lay, pacmanAgent, ghosts, catchExceptions)
+  return matchupIndex, gameIndex, simulation.GameResult(gameIndex, game, time.time() - start)
+
+def runTournament(matchups, numGames, baseSeed, workers=0, timeout=30, catchExceptions=False):
+  """
+  Plays numGames games of every matchup and yields (matchupIndex,
+  GameResult) pairs as the games finish.  With workers > 0 the games are
+  played in that many processes, so they finish out of order; results
+  are always identified by matchup and game index, and agents may not
+  start worker pools of their own.
+  """
+  if workers > 0:
+    for matchup in matchups:
+      for spec in [matchup.pacman, matchup.ghost]:
+        if int(parseAgentSpec(spec)[1].get('workers', 0)) > 0:
+          raise Exception('%s starts its own worker processes, which a tournament played by workers cannot do '
+                          '(pool processes cannot have children); use --workers 0 or drop its workers option' % spec)
+  jobs = [(m, g, matchups[m], gameSeed(baseSeed, m, g), timeout, catchExceptions)
+          for g in range(numGames) for m in range(len(matchups))]
+  if workers <= 0:
+    for job in jobs:
+      matchupIndex, gameIndex, result = playTournamentGame(job)
+      yield matchupIndex, result
+    return
+
+  import multiprocessing
+  pool = multiprocessing.Pool(workers)
+  try:
+    for matchupIndex, gameIndex, result in pool.imap_unordered(playTournamentGame, jobs):
+      yield matchupIndex, result
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+
+def printStandings(stats):
+  "Prints each matchup's games, win rate and score means with 95% intervals, score spread and game length."
+  width = max([len(str(matchupStats.matchup)) for matchupStats in stats] + [len('Matchup')])
+  print '%-*s %6s  %-14s  %-20s  %8s  %7s' % (width, 'Matchup', 'Games', 'Win rate', 'Score', 'Std dev', 'Moves')
+  for matchupStats in stats:
+    print matchupStats.row(width)
+
+def readCommand(argv):
+  from optparse import OptionParser
+  parser = OptionParser(__doc__)
+  parser.add_option('-p', '--pacman', dest='pacman', action='append',
+                    help='a Pacman agent TYPE, optionally with arguments as TYPE:opt1=val1,opt2=val2 (repeatable) [Default: ReflexAgent]')
+  parser.add_option('-g', '--ghosts', dest='ghost', action='append',
+                    help='a ghost agent TYPE, as for --pacman (repeatable) [Default: RandomGhost]')
+  parser.add_option('-l', '--layout', dest='layout', action='append',
+                    help='a LAYOUT_FILE to play on (repeatable) [Default: mediumClassic]')
+  parser.add_option('-k', '--numghosts', type='int', dest='numGhosts', default=4,
+                    help=pacman.default('The maximum number of ghosts to use'))
+  parser.add_option('-n', '--numGames', dest='numGames', type='int', default=100,
+                    help=pacman.default('the number of GAMES to play per matchup'), metavar='GAMES')
+  parser.add_option('-w', '--workers', dest='workers', type='int', default=0,
+                    help=pacman.default('the number of worker processes; 0 plays in this process'))
+  parser.add_option('-f', '--fixRandomSeed', action='store_true', dest='fixRandomSeed', default=False,
+                    help='Seeds every game from a fixed base seed, to always play the same tournament')
+  parser.add_option('-c', '--catchExceptions', action='store_true', dest='catchExceptions', default=False,
+                    help='Turns on exception handling and timeouts during games')
+  parser.add_option('--timeout', dest='timeout', type='int', default=30,
+                    help=pacman.default('Maximum length of time an agent can spend computing in a single game'))
+  parser.add_option('--layoutCache', dest='layoutCache', default=None,
+                    help='A directory in which to keep parsed layouts; it must be trusted, as its files are unpickled')
+  parser.add_option('--reportEvery', dest='reportEvery', type='int', default=0,
+                    help=pacman.default('print the standings after every N finished games; 0 only at the end'))
+  options, otherjunk = parser.parse_args(argv)
+  if len(otherjunk) != 0:
+    raise Exception('Command line input not understood: ' + str(otherjunk))
+  return options
+
+if __name__ == '__main__':
+  options = readCommand(sys.argv[1:])
+  layout.LAYOUT_CACHE_DIR = options.layoutCache
+  baseSeed = 'cs188'
+  if not options.fixRandomSeed: baseSeed = str(random.getrandbits(32))
+  matchups = []
+  for layoutName in options.layout or ['mediumClassic']:
+    numGhosts = min(options.numGhosts, _loadLayout(layoutName).getNumGhosts())
+    for pacmanSpec in options.pacman or ['ReflexAgent']:
+      for ghostSpec in options.ghost or ['RandomGhost']:
+        matchups.append(Matchup(pacmanSpec, ghostSpec, layoutName, numGhosts))
+
+  stats = [MatchupStats(matchup) for matchup in matchups]
+  start = time.time()
+  finished = 0
+  for matchupIndex, result in runTournament(matchups, options.numGames, baseSeed, options.workers,
+                                            options.timeout, options.catchExceptions):
+    stats[matchupIndex].add(result)
+    finished += 1
+    if options.reportEvery > 0 and finished % options.reportEvery == 0:
+      print '%d games played' % finished
+      printStandings(stats)
+  elapsed = time.time() - start
+  print 'Tournament seed %s: %d games in %.1fs (%.1f games/s)' % (baseSeed, finished, elapsed, finished / max(elapsed, 1e-9))
+  printStandings(stats)
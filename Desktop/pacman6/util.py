@@ -43,6 +43,93 @@ class PriorityQueue:
   def isEmpty(self):
     return len(self.heap) == 0
 
+class TranspositionTable:
+  """
+  A bounded table of search values keyed by position.  Each entry records
+  the depth it was searched to: lookups only succeed for entries searched
+  at least as deep as requested and a shallower result never replaces a
+  deeper one.  When the table is full the least recently used quarter of
+  the entries is evicted in one pass.
+  """
+  def __init__(self, size):
+    self.size = size
+    self.entries = {}
+    self.clock = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def lookup(self, key, depth):
+    "Returns the stored value for key if searched to at least depth, else None"
+    entry = self.entries.get(key)
+    if entry == None or entry[0] < depth:
+      self.misses += 1
+      return None
+    self.clock += 1
+    entry[2] = self.clock
+    self.hits += 1
+    return entry[1]
+
+  def store(self, key, depth, value):
+    self.clock += 1
+    entry = self.entries.get(key)
+    if entry != None:
+      if entry[0] <= depth:
+        entry[0], entry[1] = depth, value
+      entry[2] = self.clock
+      return
+    if len(self.entries) >= self.size:
+      self._evict()
+    self.entries[key] = [depth, value, self.clock]
+
+  def _evict(self):
+    stamps = sorted([entry[2] for entry in self.entries.values()])
+    cutoff = stamps[len(stamps) / 4]
+    for key in [key for key, entry in self.entries.items() if entry[2] <= cutoff]:
+      del self.entries[key]
+      self.evictions += 1
+
+  def clear(self):
+    self.entries.clear()
+    self.hits, self.misses, self.evictions = 0, 0, 0
+
+  def hitRate(self):
+    total = self.hits + self.misses
+    if total == 0: return 0.0
+    return self.hits / float(total)
+
+  def __len__(self):
+    return len(self.entries)
+
+class RunningStats:
+  """
+  Count, mean and variance of a stream of numbers, updated one value at a
+  time (Welford's method) so that the values themselves need not be kept.
+  """
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self.sumSquares = 0.0
+
+  def add(self, value):
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.sumSquares += delta * (value - self.mean)
+
+  def variance(self):
+    "The sample variance, or 0 with fewer than two values."
+    if self.count < 2: return 0.0
+    return self.sumSquares / (self.count - 1)
+
+  def stdDev(self):
+    return self.variance() ** 0.5
+
+  def confidenceInterval(self, z=1.96):
+    "Half-width of the normal-approximation confidence interval of the mean (95% by default)."
+    if self.count < 2: return float('inf')
+    return z * (self.variance() / self.count) ** 0.5
+
 class PriorityQueueWithFunction(PriorityQueue):
   def  __init__(self, priorityFunction):
     "priorityFunction (item) -> priority"
@@ -263,29 +350,79 @@ def pause():
   print "<Press enter/return to continue>"
   raw_input()
   
-import signal
+import signal, time
 class TimeoutFunctionException(Exception):
     """Exception to raise on a timeout"""
     pass
 
+_alarmInstalled = None
+_callDeadline = None
+
+def _handleAlarm(signum, frame):
+    raise TimeoutFunctionException()
+
+def _installAlarm():
+    """
+    Installs the SIGALRM handler behind timedCall, once per process.
+    Returns whether timed calls can be interrupted: not without
+    setitimer (Windows) or off the main thread.
+    """
+    global _alarmInstalled
+    if _alarmInstalled == None:
+        _alarmInstalled = False
+        if 'setitimer' in dir(signal):
+            try:
+                signal.signal(signal.SIGALRM, _handleAlarm)
+                _alarmInstalled = True
+            except ValueError:
+                pass
+    return _alarmInstalled
+
+def getCallDeadline():
+    """
+    The time.time() by which the innermost running timedCall has to
+    return, or None outside timed calls.  Agents can poll it to stop
+    searching before they are interrupted.
+    """
+    return _callDeadline
+
+def timedCall(timeout, function, *args):
+    """
+    Returns function(*args), raising TimeoutFunctionException if it runs
+    for longer than timeout seconds, with sub-millisecond resolution.
+    Each call only arms and disarms an interval timer.  Where calls cannot
+    be interrupted they run to completion, and only getCallDeadline
+    reflects the timeout.
+    """
+    global _callDeadline
+    if timeout <= 0:
+        raise TimeoutFunctionException()
+    alarm = _installAlarm()
+    outerDeadline = _callDeadline
+    deadline = time.time() + timeout
+    if outerDeadline != None:
+        deadline = min(deadline, outerDeadline)
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        # The enclosing call is already overdue; setitimer rejects negative delays.
+        raise TimeoutFunctionException()
+    _callDeadline = deadline
+    if alarm: signal.setitimer(signal.ITIMER_REAL, max(remaining, 1e-6))
+    try:
+        return function(*args)
+    finally:
+        if alarm: signal.setitimer(signal.ITIMER_REAL, 0)
+        _callDeadline = outerDeadline
+        if alarm and outerDeadline != None:
+            # Re-arm the enclosing call's timer, expiring at once if it is overdue.
+            signal.setitimer(signal.ITIMER_REAL, max(outerDeadline - time.time(), 1e-6))
+
 class TimeoutFunction:
+    "function, made to raise TimeoutFunctionException after timeout seconds; see timedCall."
 
     def __init__(self, function, timeout):
-        "timeout must be at least 1 second. WHY??"
         self.timeout = timeout
         self.function = function
 
-    def handle_timeout(self, signum, frame):
-        raise TimeoutFunctionException()
-
     def __call__(self, *args):
-        if not 'SIGALRM' in dir(signal):
-            return self.function(*args)
-        old = signal.signal(signal.SIGALRM, self.handle_timeout)
-        signal.alarm(self.timeout)
-        try:
-            result = self.function(*args)
-        finally:
-            signal.signal(signal.SIGALRM, old)
-        signal.alarm(0)
-        return result
+        return timedCall(self.timeout, self.function, *args)